@@ -1,5 +1,7 @@
 from django.contrib import admin
 
-from notificationsapp.models import Mailout, MailoutRecipient, MailoutMessage
+from notificationsapp.models import Mailout, MailoutRecipient, MailoutMessage, \
+    MailoutStats, RecipientTag
 
-admin.site.register((Mailout, MailoutRecipient, MailoutMessage,))
+admin.site.register((Mailout, MailoutRecipient, MailoutMessage, MailoutStats,
+                     RecipientTag,))
@@ -5,3 +5,6 @@ class NotificationsappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'notificationsapp'
     verbose_name = 'Notifications App'
+
+    def ready(self):
+        from notificationsapp import profiling, signals  # noqa: F401
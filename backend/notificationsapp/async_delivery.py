@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+import time
+
+import aiohttp
+from celery.signals import worker_process_init, worker_process_shutdown
+from django.conf import settings
+from rest_framework import status
+
+from notificationsapp.breaker import get_circuit_breaker
+from notificationsapp.idempotency import DUPLICATE_RESULTS
+from notificationsapp.metrics import observe_delivery
+from notificationsapp.ratelimit import get_rate_limiter, report_throttle
+from settings.commons import THROTTLE_CODES, CIRCUIT_OPEN_CODE
+
+_loop = None
+_session = None
+
+
+def run_blocking(func, *args):
+    # Redis and cache round trips go to the default executor, so they
+    # don't hold up every other send on the event loop.
+    return asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+async def deliver_message(session, semaphore, message_id, phone, text,
+                          guard=None):
+    payload = json.dumps({
+        "id": int(message_id),
+        "phone": int(phone),
+        "text": text
+    })
+    async with semaphore:
+        breaker = get_circuit_breaker()
+        if not await run_blocking(breaker.allow_request):
+            return {
+                "id": int(message_id),
+                "code": CIRCUIT_OPEN_CODE,
+                "body": 'provider circuit open'
+            }
+        wait = await run_blocking(get_rate_limiter().acquire, phone)
+        if wait:
+            await asyncio.sleep(wait)
+        claim = await run_blocking(guard.claim, message_id, phone) \
+            if guard else None
+        if claim is not None:
+            # If this call had the half-open probe, someone else may use it.
+            await run_blocking(breaker.release)
+            return dict(DUPLICATE_RESULTS[claim], id=int(message_id))
+        started = time.perf_counter()
+        try:
+            async with session.post(f'{settings.SMS_API_URL}{message_id}',
+                                    data=payload) as resp:
+                body = await resp.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            observe_delivery(phone, status.HTTP_503_SERVICE_UNAVAILABLE,
+                             time.perf_counter() - started)
+            await run_blocking(breaker.record,
+                               status.HTTP_503_SERVICE_UNAVAILABLE)
+            if guard:
+                await run_blocking(guard.release, message_id, phone)
+            return {
+                "id": int(message_id),
+                "code": status.HTTP_503_SERVICE_UNAVAILABLE,
+                "body": str(exc) or exc.__class__.__name__
+            }
+    observe_delivery(phone, resp.status, time.perf_counter() - started)
+    await run_blocking(breaker.record, resp.status)
+    if guard:
+        await run_blocking(guard.settle, message_id, phone, resp.status)
+    if resp.status in THROTTLE_CODES:
+        await run_blocking(report_throttle)
+    return {
+        "id": int(message_id),
+        "code": resp.status,
+        "body": body[:settings.SMS_API_RESPONSE_LIMIT]
+    }
+
+
+def get_session():
+    # Created inside the loop it is used on, and kept with it, so
+    # connections to the provider stay open from one task to the next.
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=settings.SMS_API_ASYNC_CONCURRENCY)
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=settings.SMS_API_CONNECT_TIMEOUT,
+            sock_read=settings.SMS_API_READ_TIMEOUT)
+        headers = {
+            "accept": 'application/json',
+            "Authorization": f'Bearer {os.environ.get("API_TOKEN")}'
+        }
+        _session = aiohttp.ClientSession(connector=connector,
+                                         timeout=timeout, headers=headers)
+    return _session
+
+
+def get_loop():
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop
+
+
+async def deliver_messages(messages, concurrency=None, guard=None):
+    semaphore = asyncio.Semaphore(
+        concurrency or settings.SMS_API_ASYNC_CONCURRENCY)
+    session = get_session()
+    return await asyncio.gather(*(
+        deliver_message(session, semaphore, message_id, phone, text, guard)
+        for message_id, phone, text in messages
+    ))
+
+
+def run_delivery(messages, concurrency=None, guard=None):
+    return get_loop().run_until_complete(
+        deliver_messages(messages, concurrency, guard))
+
+
+@worker_process_init.connect
+def start_delivery_loop(**kwargs):
+    # Every pool process runs its batches on one loop of its own, never
+    # on the parent's.
+    global _loop, _session
+    _loop = asyncio.new_event_loop()
+    _session = None
+
+
+@worker_process_shutdown.connect
+def stop_delivery_loop(**kwargs):
+    global _loop, _session
+    if _loop is None or _loop.is_closed():
+        return
+    if _session is not None:
+        _loop.run_until_complete(_session.close())
+    _loop.close()
+    _loop = _session = None
@@ -0,0 +1,113 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from notificationsapp.caching import get_validators, get_response_key, \
+    set_validators, is_not_modified, CachedResponseMixin
+from notificationsapp.db_router import reads_may_be_stale
+from notificationsapp.views import MailoutListApiView, MailoutDetailApiView, \
+    MailoutMessagesApiView
+
+JSON_MEDIA_TYPE = 'application/json'
+
+
+def read_only(func):
+    # Django gives every ASGI request a thread-sensitive thread of its own,
+    # so the request's ORM work shares one connection there, and slow reads
+    # don't queue behind other requests. request_finished closes it at the
+    # end of the request, as under WSGI.
+    return sync_to_async(func, thread_sensitive=True)
+
+
+def wants_json(request):
+    return request.GET.get('format') == 'json' or \
+        JSON_MEDIA_TYPE in request.headers.get('Accept', '')
+
+
+def build_list(view):
+    queryset = view.filter_queryset(view.get_queryset())
+    page = view.paginate_queryset(queryset)
+    serializer = view.get_serializer(page, many=True)
+    return view.get_paginated_response(serializer.data).data
+
+
+def build_detail(view):
+    return view.get_serializer(view.get_object()).data
+
+
+def render_error(view, exc):
+    return view.finalize_response(view.request,
+                                  view.handle_exception(exc)).render()
+
+
+def initialize_view(view_class, request, kwargs):
+    # Authentication, permissions and throttling, as in dispatch(), before
+    # anything is served, cached bodies and 304s included.
+    view = view_class(args=(), kwargs=kwargs, format_kwarg=None)
+    view.request = view.initialize_request(request, **kwargs)
+    view.headers = {}
+    try:
+        view.initial(view.request)
+    except Exception as exc:
+        return view, render_error(view, exc)
+    return view, None
+
+
+def render_view(view, build):
+    try:
+        return HttpResponse(JSONRenderer().render(build(view)),
+                            content_type=JSON_MEDIA_TYPE)
+    except Exception as exc:
+        return render_error(view, exc)
+
+
+def async_read_view(view_class, build):
+    # Serves JSON GETs of a read-only DRF view natively under ASGI, with
+    # the same ETags and cached bodies as the view itself. Anything else
+    # (the browsable API) goes to the DRF view.
+    sync_view = sync_to_async(view_class.as_view())
+
+    async def view(request, **kwargs):
+        if request.method != 'GET' or not wants_json(request):
+            return await sync_view(request, **kwargs)
+        drf_view, error = await read_only(initialize_view)(
+            view_class, request, kwargs)
+        if error is not None:
+            return error
+        version_keys = drf_view.get_version_keys() \
+            if isinstance(drf_view, CachedResponseMixin) and \
+            settings.CACHE_SHARED else ()
+        etag = None
+        if version_keys:
+            etag, last_modified = await read_only(get_validators)(
+                request.build_absolute_uri(), JSON_MEDIA_TYPE, '',
+                version_keys)
+            if reads_may_be_stale(last_modified):
+                etag = None
+            elif is_not_modified(request, etag, last_modified):
+                return set_validators(HttpResponseNotModified(), etag,
+                                      last_modified)
+        if etag is not None:
+            content = await read_only(cache.get)(get_response_key(etag))
+            if content is not None:
+                return set_validators(HttpResponse(
+                    content, content_type=JSON_MEDIA_TYPE), etag,
+                    last_modified)
+        response = await read_only(render_view)(drf_view, build)
+        if etag is None or response.status_code != status.HTTP_200_OK:
+            return response
+        await read_only(cache.set)(get_response_key(etag), response.content,
+                                   settings.MAILOUT_RESPONSE_CACHE_TIMEOUT)
+        return set_validators(response, etag, last_modified)
+
+    view.cls = view_class
+    view.initkwargs = {}
+    return view
+
+
+mailout_list = async_read_view(MailoutListApiView, build_list)
+mailout_detail = async_read_view(MailoutDetailApiView, build_detail)
+mailout_messages = async_read_view(MailoutMessagesApiView, build_list)
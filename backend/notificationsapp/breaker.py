@@ -0,0 +1,123 @@
+import math
+import threading
+import time
+
+import redis
+from celery.signals import worker_process_init
+from django.conf import settings
+
+FAILURES_KEY = 'breaker:sms-api:failures'
+OPEN_KEY = 'breaker:sms-api:open'
+HALF_OPEN_KEY = 'breaker:sms-api:half-open'
+PROBE_KEY = 'breaker:sms-api:probe'
+
+_breaker = None
+
+
+def is_provider_failure(code):
+    return code is not None and code >= 500
+
+
+class RedisCircuitBreaker:
+    # Shared by all workers: once the provider fails
+    # SMS_API_BREAKER_THRESHOLD times within SMS_API_BREAKER_WINDOW
+    # seconds nobody calls it for SMS_API_BREAKER_RESET seconds. After
+    # that a single probe request decides whether it closes again.
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+
+    def allow_request(self):
+        if self.client.exists(OPEN_KEY):
+            return False
+        if not self.client.exists(HALF_OPEN_KEY):
+            return True
+        return bool(self.client.set(
+            PROBE_KEY, 1, nx=True,
+            ex=int(math.ceil(settings.SMS_API_READ_TIMEOUT)) + 1))
+
+    def record(self, code):
+        if not is_provider_failure(code):
+            if self.client.exists(HALF_OPEN_KEY, FAILURES_KEY):
+                self.client.delete(HALF_OPEN_KEY, FAILURES_KEY, PROBE_KEY)
+            return
+        if self.client.exists(HALF_OPEN_KEY):
+            self.trip()
+            return
+        failures = self.client.incr(FAILURES_KEY)
+        if failures == 1:
+            self.client.expire(FAILURES_KEY, settings.SMS_API_BREAKER_WINDOW)
+        if failures >= settings.SMS_API_BREAKER_THRESHOLD:
+            self.trip()
+
+    def release(self):
+        # Gives back a probe that was never sent.
+        self.client.delete(PROBE_KEY)
+
+    def trip(self):
+        with self.client.pipeline() as pipe:
+            pipe.set(OPEN_KEY, 1, ex=settings.SMS_API_BREAKER_RESET)
+            # Half-open expires too, so a probe that never reports back
+            # can't keep the breaker from closing.
+            pipe.set(HALF_OPEN_KEY, 1, ex=2 * settings.SMS_API_BREAKER_RESET)
+            pipe.delete(FAILURES_KEY, PROBE_KEY)
+            pipe.execute()
+
+
+class LocalCircuitBreaker:
+    # Same states within a single process, for setups without Redis.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = []
+        self.open_until = 0
+        self.half_open = False
+        self.probing = False
+
+    def allow_request(self):
+        with self.lock:
+            if time.monotonic() < self.open_until:
+                return False
+            if not self.half_open:
+                return True
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def release(self):
+        with self.lock:
+            self.probing = False
+
+    def record(self, code):
+        with self.lock:
+            now = time.monotonic()
+            if not is_provider_failure(code):
+                self.failures = []
+                self.half_open = self.probing = False
+                return
+            self.failures = [moment for moment in self.failures
+                             if now - moment < settings.SMS_API_BREAKER_WINDOW]
+            self.failures.append(now)
+            if self.half_open or \
+                    len(self.failures) >= settings.SMS_API_BREAKER_THRESHOLD:
+                self.failures = []
+                self.open_until = now + settings.SMS_API_BREAKER_RESET
+                self.half_open = True
+                self.probing = False
+
+
+def get_circuit_breaker():
+    global _breaker
+    if _breaker is None:
+        if settings.SMS_API_RATE_LIMIT_URL:
+            _breaker = RedisCircuitBreaker(settings.SMS_API_RATE_LIMIT_URL)
+        else:
+            _breaker = LocalCircuitBreaker()
+    return _breaker
+
+
+@worker_process_init.connect
+def reset_circuit_breaker(**kwargs):
+    global _breaker
+    _breaker = None
@@ -0,0 +1,129 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_etags, quote_etag, \
+    parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+from notificationsapp.db_router import reads_may_be_stale
+
+MAILOUTS_VERSION = 'response-version:mailouts'
+MAILOUT_VERSION = 'response-version:mailout:%s'
+ACTIVE_SCOPE_RESOLUTION = 60
+
+
+def touch_mailouts(mailout_ids):
+    # Versions are bumped only once the change is committed, so a reader
+    # that sees a new version also sees the new data.
+    keys = [MAILOUTS_VERSION] + [MAILOUT_VERSION % mailout_id
+                                 for mailout_id in mailout_ids]
+    transaction.on_commit(lambda: cache.set_many(
+        dict.fromkeys(keys, time.time()), None))
+
+
+def get_versions(keys):
+    versions = cache.get_many(keys)
+    missing = {key: time.time() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def get_validators(url, media_type, scope, keys):
+    versions = get_versions(keys)
+    etag = quote_etag(hashlib.md5(repr((
+        url, media_type, scope, versions)).encode()).hexdigest())
+    return etag, max(versions)
+
+
+def get_response_key(etag):
+    return 'response:%s' % etag.strip('"')
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def is_not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return etag in parse_etags(if_none_match) or \
+            if_none_match.strip() == '*'
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    return if_modified_since is not None and \
+        int(last_modified) <= if_modified_since
+
+
+class CachedResponseMixin:
+    # JSON list and detail responses are cached under an ETag derived from
+    # the request and the versions of the mailouts they show. Checking a
+    # poll against its ETag only reads those versions, never the database.
+    # That takes a cache shared by every process that changes mailouts.
+    list_version_keys = (MAILOUTS_VERSION,)
+    detail_version_keys = (MAILOUT_VERSION,)
+
+    def get_version_keys(self):
+        if self.lookup_field in self.kwargs:
+            return [key % self.kwargs[self.lookup_field]
+                    for key in self.detail_version_keys]
+        return list(self.list_version_keys)
+
+    def get_cache_scope(self):
+        return ''
+
+    def get_cached_response(self, request, respond):
+        if request.accepted_renderer.format != 'json' or \
+                not settings.CACHE_SHARED:
+            return respond()
+        etag, last_modified = get_validators(
+            request.build_absolute_uri(), request.accepted_media_type,
+            self.get_cache_scope(), self.get_version_keys())
+        if reads_may_be_stale(last_modified):
+            # A lagging replica could still render the old data, which must
+            # not be cached or validated under the new versions.
+            return respond()
+        if is_not_modified(request, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            key = get_response_key(etag)
+            cached = cache.get(key)
+            if cached is not None:
+                response = HttpResponse(cached, content_type=(
+                    request.accepted_renderer.media_type))
+            else:
+                response = respond()
+                if response.status_code == status.HTTP_200_OK:
+                    response.add_post_render_callback(
+                        lambda rendered: cache.set(
+                            key, rendered.content,
+                            settings.MAILOUT_RESPONSE_CACHE_TIMEOUT))
+        return set_validators(response, etag, last_modified)
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, lambda: super(CachedResponseMixin, self).list(
+                request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, lambda: super(CachedResponseMixin, self).retrieve(
+                request, *args, **kwargs))
+
+
+class ActiveCachedResponseMixin(CachedResponseMixin):
+    # For views limited to mailouts that haven't finished yet: cached
+    # responses also expire as time moves past their finish dates.
+
+    def get_cache_scope(self):
+        return int(time.time() // ACTIVE_SCOPE_RESOLUTION)
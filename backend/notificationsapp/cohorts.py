@@ -0,0 +1,30 @@
+from django.db.models import Count
+
+from notificationsapp.segments import get_segment_recipients
+
+
+def format_utc_offset(moment):
+    minutes = int(moment.utcoffset().total_seconds() // 60)
+    sign = '-' if minutes < 0 else '+'
+    return '%s%02d:%02d' % (sign, abs(minutes) // 60, abs(minutes) % 60)
+
+
+def get_cohort_plan(mailout):
+    # Timezones that share a UTC offset during the mailout window share a
+    # cohort; cohorts are listed in the order they start.
+    timezones = get_segment_recipients(
+        mailout.filter_field, mailout.filter_value).order_by().values(
+        'timezone').annotate(recipients=Count('id'))
+    cohorts = {}
+    for row in timezones:
+        start, finish = mailout.get_window(row['timezone'])
+        cohort = cohorts.setdefault((start, finish), {
+            'utc_offset': format_utc_offset(start),
+            'datetime_start': start,
+            'datetime_finish': finish,
+            'timezones': [],
+            'recipients': 0,
+        })
+        cohort['timezones'].append(row['timezone'])
+        cohort['recipients'] += row['recipients']
+    return [cohorts[window] for window in sorted(cohorts)]
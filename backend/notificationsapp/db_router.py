@@ -0,0 +1,60 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# The primary's transaction depth when replica reads were turned on, None
+# while they are off.
+replica_reads_depth = ContextVar('replica_reads_depth', default=None)
+
+
+def get_atomic_depth():
+    connection = connections[DEFAULT_DB_ALIAS]
+    return connection.in_atomic_block + len(connection.savepoint_ids)
+
+
+@contextmanager
+def replica_reads():
+    token = replica_reads_depth.set(
+        get_atomic_depth() if settings.DATABASE_REPLICAS else None)
+    try:
+        yield
+    finally:
+        replica_reads_depth.reset(token)
+
+
+def reading_from_replicas():
+    return replica_reads_depth.get() is not None
+
+
+def reads_may_be_stale(changed_at):
+    # Data changed less than the replication lag ago may not have reached
+    # the replica this request reads from yet.
+    return reading_from_replicas() and \
+        time.time() - changed_at < settings.DATABASE_REPLICA_LAG
+
+
+class ReplicaRouter:
+    # Reads go to a random replica only inside replica_reads() (read-only
+    # API requests and exports) and outside transactions opened there;
+    # everything else, including every write, goes to the primary.
+
+    def db_for_read(self, model, **hints):
+        depth = replica_reads_depth.get()
+        if depth is None or get_atomic_depth() > depth:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
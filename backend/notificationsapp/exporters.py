@@ -0,0 +1,55 @@
+import csv
+import json
+
+from django.conf import settings
+from django.utils import timezone
+
+from notificationsapp.models import MailoutMessage
+from notificationsapp.utils import iter_queryset_chunks
+from settings.commons import CSV_FORMAT, NDJSON_FORMAT
+
+REPORT_COLUMNS = ('id', 'phone', 'status', 'sent_at', 'attempts',)
+REPORT_FIELDS = ('id', 'recipient__phone', 'status', 'sent_at', 'attempts',)
+CONTENT_TYPES = {
+    CSV_FORMAT: 'text/csv',
+    NDJSON_FORMAT: 'application/x-ndjson',
+}
+
+
+class LineBuffer:
+    def write(self, line):
+        return line
+
+
+def iter_report_rows(mailout, chunk_size=None):
+    # One chunk of rows at a time, so a report of any size is never held
+    # in memory as a whole.
+    messages = MailoutMessage.objects.filter(mailout=mailout)
+    for chunk in iter_queryset_chunks(
+            messages, REPORT_FIELDS,
+            chunk_size or settings.MAILOUT_EXPORT_CHUNK_SIZE):
+        yield [(message_id, phone, status,
+                sent_at and timezone.localtime(sent_at).isoformat(), attempts)
+               for message_id, phone, status, sent_at, attempts in chunk]
+
+
+def write_csv(chunks):
+    writer = csv.writer(LineBuffer())
+    yield writer.writerow(REPORT_COLUMNS)
+    for rows in chunks:
+        yield ''.join(writer.writerow(row) for row in rows)
+
+
+def write_ndjson(chunks):
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(REPORT_COLUMNS, row))) + '\n'
+                      for row in rows)
+
+
+def export_report(mailout, file_format, chunk_size=None):
+    writer = write_ndjson if file_format == NDJSON_FORMAT else write_csv
+    return writer(iter_report_rows(mailout, chunk_size))
+
+
+def get_report_filename(mailout, file_format):
+    return 'mailout-%s-report.%s' % (mailout.id, file_format)
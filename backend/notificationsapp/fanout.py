@@ -0,0 +1,263 @@
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from functools import partial
+
+from celery.utils import uuid
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from notificationsapp.metrics import FANOUT_MESSAGES
+from notificationsapp.models import MailoutMessage, MailoutRecipient, \
+    MailoutStats
+from notificationsapp.revocation import revoke_tasks
+from notificationsapp.segments import get_segment, get_segment_recipients
+from notificationsapp.tasks import send_message, send_message_batch
+from notificationsapp.utils import iter_chunks, iter_queryset_chunks
+from settings.commons import PENDING_STATUS, SUCCESS_STATUS, \
+    SCHEDULED_STATUS, FAILURE_STATUS, FINAL_STATUSES
+
+SCHEDULE_FIELDS = ('text', 'datetime_start', 'datetime_finish',
+                   'local_time',)
+RECIPIENT_FIELDS = ('id', 'phone', 'timezone',)
+
+
+def iter_recipient_chunks(mailout, chunk_size):
+    segment = get_segment(mailout.filter_field, mailout.filter_value)
+    if segment['ids'] is not None:
+        for ids in iter_chunks(segment['ids'], chunk_size):
+            yield list(MailoutRecipient.objects.filter(
+                id__in=ids).values_list(*RECIPIENT_FIELDS))
+        return
+    yield from iter_queryset_chunks(get_segment_recipients(
+        mailout.filter_field, mailout.filter_value), RECIPIENT_FIELDS,
+        chunk_size)
+
+
+def assign_tasks(mailout, messages):
+    # Task IDs are stored before publishing, so a result can never
+    # arrive for a task ID that isn't in the database yet.
+    batches = list(iter_chunks(messages, settings.MAILOUT_SEND_BATCH_SIZE))
+    changes = Counter()
+    for batch in batches:
+        task_id = uuid()
+        for message in batch:
+            changes[message.status] -= 1
+            changes[PENDING_STATUS] += 1
+            message.task_id = task_id
+            message.status = PENDING_STATUS
+    MailoutMessage.objects.bulk_update(messages, ('task_id', 'status',))
+    MailoutStats.adjust(mailout.id, changes)
+    return batches
+
+
+def publish_tasks(mailout, batches, phones, eta=None, expires=None):
+    with send_message.app.producer_or_acquire() as producer:
+        for batch in batches:
+            if len(batch) == 1:
+                task = send_message
+                args = (batch[0].id, phones[batch[0].recipient_id],
+                        mailout.text)
+            else:
+                task = send_message_batch
+                args = ([(message.id, phones[message.recipient_id])
+                         for message in batch], mailout.text)
+            task.apply_async(
+                args=args,
+                kwargs={'mailout_id': mailout.id},
+                eta=eta,
+                expires=expires or mailout.datetime_finish,
+                task_id=batch[0].task_id,
+                producer=producer
+            )
+
+
+def schedule_messages(mailout, messages, due_at):
+    changes = Counter()
+    for message in messages:
+        changes[message.status] -= 1
+        changes[SCHEDULED_STATUS] += 1
+        message.status = SCHEDULED_STATUS
+        message.task_id = None
+        message.due_at = due_at
+    MailoutMessage.objects.bulk_update(messages,
+                                       ('status', 'task_id', 'due_at',))
+    MailoutStats.adjust(mailout.id, changes)
+
+
+def dispatch_messages(mailout, messages, phones, window=None):
+    # With the due-message dispatcher enabled, messages that aren't due
+    # within the next tick wait in the database instead of sitting in
+    # the broker as ETA tasks.
+    start, finish = window or mailout.get_window()
+    now = timezone.now()
+    if finish <= now:
+        drop_messages(mailout, messages)
+        return
+    horizon = now + timedelta(seconds=settings.MAILOUT_DISPATCH_INTERVAL)
+    if settings.MAILOUT_DUE_DISPATCHER and start > horizon:
+        schedule_messages(mailout, messages, start)
+        return
+    publish_tasks(mailout, assign_tasks(mailout, messages), phones,
+                  eta=start, expires=finish)
+
+
+def dispatch_cohorts(mailout, messages, phones, timezones):
+    # Local time mailouts get one dispatch per UTC offset cohort, each
+    # with its own window.
+    cohorts = defaultdict(list)
+    for message in messages:
+        cohorts[mailout.get_window(
+            timezones[message.recipient_id])].append(message)
+    for window, cohort in sorted(cohorts.items()):
+        dispatch_messages(mailout, cohort, phones, window)
+
+
+def release_due_messages(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(MailoutMessage.objects.select_for_update(
+            skip_locked=True, of=('self',)).filter(
+            status=SCHEDULED_STATUS, due_at__lte=now).select_related(
+            'mailout', 'recipient').order_by('due_at')[:batch_size])
+        cohorts = defaultdict(list)
+        for message in messages:
+            cohorts[message.mailout, message.get_window()].append(message)
+        for (mailout, (_, finish)), cohort in cohorts.items():
+            if finish <= now:
+                drop_messages(mailout, cohort)
+                continue
+            batches = assign_tasks(mailout, cohort)
+            phones = {message.recipient_id: message.recipient.phone
+                      for message in cohort}
+            transaction.on_commit(partial(
+                publish_due_tasks, mailout, batches, phones, finish))
+    return len(messages)
+
+
+def publish_due_tasks(mailout, batches, phones, expires):
+    # Runs after the release has committed. If the broker fails, messages
+    # still waiting on these tasks go back to SCHEDULED and the next tick
+    # releases them again; the delivery guard covers any batch that did
+    # get through before the error.
+    try:
+        publish_tasks(mailout, batches, phones, expires=expires)
+    except Exception:
+        unpublished = MailoutMessage.objects.filter(
+            status=PENDING_STATUS,
+            task_id__in=[batch[0].task_id for batch in batches]).update(
+            status=SCHEDULED_STATUS, task_id=None)
+        MailoutStats.adjust(mailout.id, {PENDING_STATUS: -unpublished,
+                                         SCHEDULED_STATUS: unpublished})
+        raise
+
+
+def drop_messages(mailout, messages):
+    changes = Counter()
+    for message in messages:
+        changes[message.status] -= 1
+        changes[FAILURE_STATUS] += 1
+        message.status = FAILURE_STATUS
+    MailoutMessage.objects.bulk_update(messages, ('status',))
+    MailoutStats.adjust(mailout.id, changes)
+
+
+def dispatch_due_messages():
+    # Releases due messages in bounded batches for at most one tick.
+    batch_size = settings.MAILOUT_DISPATCH_BATCH_SIZE
+    deadline = time.monotonic() + settings.MAILOUT_DISPATCH_INTERVAL
+    released = 0
+    while time.monotonic() < deadline:
+        count = release_due_messages(batch_size)
+        released += count
+        if count < batch_size:
+            break
+    return released
+
+
+def fan_out_mailout(mailout, recipients=None):
+    chunk_size = settings.MAILOUT_FANOUT_CHUNK_SIZE
+    if recipients is None:
+        chunks = iter_recipient_chunks(mailout, chunk_size)
+    else:
+        chunks = iter_queryset_chunks(recipients, RECIPIENT_FIELDS,
+                                      chunk_size)
+    for chunk in chunks:
+        phones = {recipient_id: phone for recipient_id, phone, _ in chunk}
+        timezones = {recipient_id: tz_name
+                     for recipient_id, _, tz_name in chunk}
+        messages = MailoutMessage.objects.bulk_create(
+            [MailoutMessage(mailout=mailout, recipient_id=recipient_id)
+             for recipient_id in phones])
+        if messages[0].pk is None:
+            # The backend can't return primary keys from a bulk INSERT.
+            messages = list(MailoutMessage.objects.filter(
+                mailout=mailout, recipient_id__in=phones,
+                task_id__isnull=True))
+        FANOUT_MESSAGES.inc(len(messages))
+        dispatch_cohorts(mailout, messages, phones, timezones)
+
+
+def revoke_messages(mailout, messages, removed=None):
+    # With MAILOUT_SEND_BATCH_SIZE > 1 a task carries several messages, so
+    # the unfinished ones sharing a task with the revoked messages get
+    # tasks of their own, unless they are being removed too. The delivery
+    # guard covers a revoked task that has already started.
+    task_ids = {task_id for _, task_id in messages} - {None, ''}
+    revoke_tasks(task_ids)
+    siblings = MailoutMessage.objects.filter(task_id__in=task_ids).exclude(
+        id__in=[message_id for message_id, _ in messages]).exclude(
+        status__in=FINAL_STATUSES)
+    if removed is not None:
+        siblings = siblings.exclude(id__in=removed.values('id'))
+    reschedule_messages(mailout, siblings, revoke=False)
+
+
+def remove_messages(mailout, messages):
+    for chunk in iter_queryset_chunks(messages, ('id', 'task_id', 'status',),
+                                      settings.MAILOUT_FANOUT_CHUNK_SIZE):
+        revoke_messages(mailout, [(message_id, task_id)
+                                  for message_id, task_id, _ in chunk],
+                        removed=messages)
+        changes = Counter()
+        for _, _, status in chunk:
+            changes[status] -= 1
+        # The response versions are bumped once the delete has committed.
+        with transaction.atomic():
+            MailoutStats.adjust(mailout.id, changes)
+            MailoutMessage.objects.filter(
+                id__in=[message_id for message_id, _, _ in chunk]).delete()
+
+
+def reschedule_messages(mailout, messages, revoke=True):
+    for chunk in iter_queryset_chunks(messages, (
+            'id', 'recipient_id', 'recipient__phone', 'recipient__timezone',
+            'task_id', 'status',), settings.MAILOUT_FANOUT_CHUNK_SIZE):
+        if revoke:
+            revoke_tasks(task_id for _, _, _, _, task_id, _ in chunk)
+        dispatch_cohorts(mailout, [
+            MailoutMessage(id=message_id, mailout=mailout,
+                           recipient_id=recipient_id, status=status)
+            for message_id, recipient_id, _, _, _, status in chunk
+        ], {recipient_id: phone for _, recipient_id, phone, _, _, _ in chunk},
+            {recipient_id: tz_name
+             for _, recipient_id, _, tz_name, _, _ in chunk})
+
+
+def reconcile_mailout(mailout, previous):
+    # Only touches what an edit actually affects: unsent messages of
+    # recipients that left the audience are revoked and deleted, unsent
+    # messages are re-dispatched if the text or schedule changed, and
+    # recipients that joined the audience get new messages. Delivered
+    # messages are never touched.
+    messages = MailoutMessage.objects.filter(mailout=mailout)
+    audience = get_segment_recipients(mailout.filter_field,
+                                      mailout.filter_value)
+    remove_messages(mailout, messages.exclude(status=SUCCESS_STATUS).exclude(
+        recipient_id__in=audience.values('id')))
+    if any(previous.get(field) != getattr(mailout, field)
+           for field in SCHEDULE_FIELDS):
+        reschedule_messages(mailout, messages.exclude(status=SUCCESS_STATUS))
+    fan_out_mailout(mailout, audience.exclude(
+        id__in=messages.values('recipient_id')))
@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import status
+
+from settings.commons import IN_PROGRESS_CODE
+
+SENDING = 'sending'
+DELIVERED = 'delivered'
+DELIVERED_GRACE = 60
+DUPLICATE_RESULTS = {
+    DELIVERED: {
+        "code": status.HTTP_200_OK,
+        "body": 'already delivered'
+    },
+    SENDING: {
+        "code": IN_PROGRESS_CODE,
+        "body": 'delivery in progress'
+    },
+}
+
+
+def get_delivery_ttl(expires):
+    # Delivered markers have to outlive every task that could still
+    # carry the message, i.e. the end of the mailout window.
+    if isinstance(expires, str):
+        expires = datetime.fromisoformat(expires)
+    if expires is None:
+        return settings.MAILOUT_IDEMPOTENCY_TTL
+    return max((expires - timezone.now()).total_seconds(), 0) + \
+        DELIVERED_GRACE
+
+
+class DeliveryGuard:
+    # Claims are taken with an atomic add on the shared cache, so only one
+    # worker at a time can call the provider for a message, and never once
+    # it has been delivered.
+
+    def __init__(self, mailout_id, ttl):
+        self.mailout_id = mailout_id
+        self.ttl = ttl
+
+    def get_keys(self, message_id, phone):
+        keys = ['delivery:message:%s' % message_id]
+        if self.mailout_id is not None:
+            keys.append('delivery:%s:%s' % (self.mailout_id, phone))
+        return keys
+
+    def claim(self, message_id, phone):
+        timeout = settings.SMS_API_CONNECT_TIMEOUT + \
+            settings.SMS_API_READ_TIMEOUT + DELIVERED_GRACE
+        claimed = []
+        for key in self.get_keys(message_id, phone):
+            if not cache.add(key, SENDING, timeout):
+                cache.delete_many(claimed)
+                return cache.get(key) or SENDING
+            claimed.append(key)
+        return None
+
+    def delivered(self, message_id, phone):
+        cache.set_many(dict.fromkeys(self.get_keys(message_id, phone),
+                                     DELIVERED), self.ttl)
+
+    def release(self, message_id, phone):
+        cache.delete_many(self.get_keys(message_id, phone))
+
+    def settle(self, message_id, phone, code):
+        if code == status.HTTP_200_OK:
+            self.delivered(message_id, phone)
+        else:
+            self.release(message_id, phone)
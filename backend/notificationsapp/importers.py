@@ -0,0 +1,155 @@
+import csv
+import io
+import json
+
+import pytz
+from django.conf import settings
+from django.db import connection, transaction
+from rest_framework import serializers
+
+from notificationsapp.models import MailoutRecipient, RecipientTag
+from notificationsapp.segments import invalidate_segments
+from notificationsapp.serializers import validate_recipient_phone
+from notificationsapp.utils import iter_chunks
+from settings.commons import CSV_FORMAT, NDJSON_FORMAT, TAG, TAG_SEPARATOR
+
+TIMEZONE_NAMES = frozenset(pytz.all_timezones)
+TAG_MAX_LENGTH = 100
+# Files are decoded with errors='replace', so bytes that aren't valid
+# UTF-8 turn into this character and fail their row only.
+UNDECODABLE = '\ufffd'
+DECODE_ERRORS = 'replace'
+
+
+def read_csv(lines):
+    # The reader raises csv.Error for a field over the size limit or (on
+    # Python 3.8) a NUL byte. That fails the row it's on, but a broken
+    # header leaves nothing to read the other rows against.
+    reader = csv.DictReader(lines)
+    try:
+        reader.fieldnames
+    except csv.Error:
+        yield None
+        return
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error:
+            row = None
+        yield row
+
+
+def read_ndjson(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row if isinstance(row, dict) else None
+
+
+def guess_format(filename):
+    if filename.endswith(('.ndjson', '.jsonl')):
+        return NDJSON_FORMAT
+    return CSV_FORMAT
+
+
+def read_rows(lines, file_format):
+    if file_format == NDJSON_FORMAT:
+        return read_ndjson(lines)
+    return read_csv(lines)
+
+
+def build_recipient(row):
+    if row is None:
+        raise serializers.ValidationError('Malformed row!')
+    if any(UNDECODABLE in str(item) for item in row.items()):
+        raise serializers.ValidationError('Row is not valid UTF-8!')
+    phone = str(row.get('phone') or '').strip()
+    prefix = str(row.get('cell_provider_prefix') or '').strip()
+    tags = row.get('tags') or row.get('tag') or ''
+    if isinstance(tags, str):
+        tags = tags.split(TAG_SEPARATOR)
+    tags = {str(tag).strip() for tag in tags} - {''}
+    timezone = str(row.get('timezone') or 'UTC').strip()
+    validate_recipient_phone(phone, prefix)
+    if not tags or any(len(tag) > TAG_MAX_LENGTH for tag in tags):
+        raise serializers.ValidationError(
+            'At least one tag of up to %d characters must be provided!'
+            % TAG_MAX_LENGTH)
+    if timezone not in TIMEZONE_NAMES:
+        raise serializers.ValidationError(
+            '"%s" is not a valid timezone!' % timezone)
+    recipient = MailoutRecipient(phone=phone, cell_provider_prefix=prefix,
+                                 timezone=timezone)
+    recipient.tag_names = tags
+    return recipient
+
+
+def copy_rows(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (
+        table, ', '.join(columns)), buffer)
+
+
+def copy_recipients(recipients):
+    # COPY can't return primary keys, so they are taken from the sequence
+    # up front and written explicitly along with the tag rows.
+    table = MailoutRecipient._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+            "FROM generate_series(1, %s)", (table, len(recipients)))
+        for recipient, (pk,) in zip(recipients, cursor.fetchall()):
+            recipient.pk = pk
+        copy_rows(cursor, table, (
+            'id', 'phone', 'cell_provider_prefix', 'timezone',), (
+            (recipient.pk, recipient.phone, recipient.cell_provider_prefix,
+             recipient.timezone) for recipient in recipients))
+        copy_rows(cursor, RecipientTag._meta.db_table, (
+            'recipient_id', 'name',), (
+            (recipient.pk, name) for recipient in recipients
+            for name in recipient.tag_names))
+
+
+def insert_recipients(recipients):
+    # A batch's recipients and tags are stored together or not at all.
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            copy_recipients(recipients)
+        else:
+            MailoutRecipient.objects.bulk_create(recipients)
+            RecipientTag.objects.bulk_create(
+                [RecipientTag(recipient=recipient, name=name)
+                 for recipient in recipients
+                 for name in recipient.tag_names])
+    segments = set()
+    for recipient in recipients:
+        segments.update(recipient.get_segments())
+        segments.update((TAG, name) for name in recipient.tag_names)
+    invalidate_segments(segments)
+
+
+def import_recipients(rows, batch_size=None):
+    batch_size = batch_size or settings.MAILOUT_IMPORT_BATCH_SIZE
+    report = {'created': 0, 'failed': 0, 'errors': []}
+    for batch in iter_chunks(enumerate(rows, start=1), batch_size):
+        recipients = []
+        for row_number, row in batch:
+            try:
+                recipients.append(build_recipient(row))
+            except serializers.ValidationError as exc:
+                report['failed'] += 1
+                if len(report['errors']) < settings.MAILOUT_IMPORT_MAX_ERRORS:
+                    report['errors'].append(
+                        {'row': row_number, 'errors': exc.detail})
+        if recipients:
+            insert_recipients(recipients)
+            report['created'] += len(recipients)
+    return report
@@ -0,0 +1,222 @@
+import json
+import random
+import threading
+from collections import Counter, defaultdict, namedtuple
+from datetime import timedelta
+
+from celery.signals import worker_process_shutdown, worker_shutdown, \
+    task_success
+from celery.utils import uuid
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from rest_framework import status
+
+from notificationsapp.metrics import INGESTION_LAG, MESSAGE_STATUSES, \
+    RETRIED_MESSAGES
+from notificationsapp.models import MailoutMessage, MailoutStats
+from notificationsapp.tasks import send_message, send_message_batch
+from settings.commons import REVOKE_STATUS, FAILURE_STATUS, SUCCESS_STATUS, \
+    RETRY_STATUS, RETRY_CODES, IN_PROGRESS_CODE, PARKED_CODES, FINAL_STATUSES
+
+DeliveryResult = namedtuple('DeliveryResult', (
+    'task_id', 'task_status', 'codes', 'batch', 'date_done',))
+
+
+def parse_codes(result):
+    if isinstance(result, list):
+        return {item.get('id'): item.get('code') for item in result}, True
+    code = result.get('code') if isinstance(result, dict) else None
+    return {None: code}, False
+
+
+def parse_task_result(task_result):
+    codes, batch = parse_codes(json.loads(task_result.result))
+    return DeliveryResult(task_result.task_id, task_result.status, codes,
+                          batch, task_result.date_created)
+
+
+def parse_return_value(task_id, result):
+    codes, batch = parse_codes(result)
+    return DeliveryResult(task_id, SUCCESS_STATUS, codes, batch,
+                          timezone.now())
+
+
+def get_retry_delay(attempts):
+    # Exponential backoff with jitter, so messages that failed together
+    # don't all come back at the same moment.
+    delay = min(settings.MAILOUT_RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0),
+                settings.MAILOUT_RETRY_MAX_DELAY)
+    return timedelta(seconds=delay / 2 + random.uniform(0, delay / 2))
+
+
+def get_park_delay(code):
+    if code == IN_PROGRESS_CODE:
+        # Another worker holds the claim for one provider call at most.
+        delay = settings.SMS_API_CONNECT_TIMEOUT + \
+            settings.SMS_API_READ_TIMEOUT
+        return timedelta(seconds=delay + random.uniform(0, delay))
+    return timedelta(seconds=settings.SMS_API_BREAKER_RESET + random.uniform(
+        0, settings.MAILOUT_RETRY_BASE_DELAY))
+
+
+def retry_messages(messages, batch, delay):
+    mailout = messages[0].mailout
+    _, finish = messages[0].get_window()
+    if batch:
+        task = send_message_batch
+        args = ([(message.id, message.recipient.phone)
+                 for message in messages], mailout.text)
+    else:
+        task = send_message
+        args = (messages[0].id, messages[0].recipient.phone, mailout.text)
+    task.apply_async(
+        args=args,
+        kwargs={'mailout_id': mailout.id},
+        eta=timezone.now() + delay,
+        expires=finish,
+        task_id=messages[0].task_id
+    )
+
+
+def apply_delivery_results(results):
+    messages = defaultdict(list)
+    for message in MailoutMessage.objects.filter(
+            task_id__in={result.task_id for result in results}
+    ).select_related('mailout', 'recipient'):
+        messages[message.task_id].append(message)
+    now = timezone.now()
+    changed = {}
+    retried = defaultdict(dict)
+    delays = defaultdict(timedelta)
+    batches = {}
+    for result in results:
+        INGESTION_LAG.observe((now - result.date_done).total_seconds())
+        for message in messages[result.task_id]:
+            if message.status in FINAL_STATUSES:
+                # A replayed result must not count another attempt.
+                continue
+            result_code = result.codes.get(message.id if result.batch else None)
+            if result_code is not None and result_code not in PARKED_CODES:
+                message.attempts += 1
+                changed[message.id] = message
+            if result_code == status.HTTP_200_OK:
+                message.status = SUCCESS_STATUS
+                message.sent_at = result.date_done
+            elif result_code in PARKED_CODES or result_code in RETRY_CODES:
+                # Messages parked by an open circuit, or by another send
+                # of the same message or phone in progress, don't use up
+                # attempts.
+                if result_code in PARKED_CODES:
+                    delay = get_park_delay(result_code)
+                else:
+                    delay = get_retry_delay(message.attempts)
+                if now + delay <= message.get_window()[1] and (
+                        result_code in PARKED_CODES or
+                        message.attempts <
+                        settings.MAILOUT_RETRY_MAX_ATTEMPTS):
+                    message.status = RETRY_STATUS
+                    RETRIED_MESSAGES.labels(str(result_code).lower()).inc()
+                    retried[result.task_id][message.id] = message
+                    delays[result.task_id] = max(delays[result.task_id],
+                                                 delay)
+                    batches[result.task_id] = result.batch
+                else:
+                    message.status = FAILURE_STATUS
+                changed[message.id] = message
+            elif result_code is not None:
+                message.status = FAILURE_STATUS
+            if result.task_status == REVOKE_STATUS and \
+                    message.status != SUCCESS_STATUS:
+                message.status = FAILURE_STATUS
+                changed[message.id] = message
+    if not changed:
+        return
+    retried = {task_id: [message for message in retried_messages.values()
+                         if message.status == RETRY_STATUS]
+               for task_id, retried_messages in retried.items()}
+    for retried_messages in retried.values():
+        # A retry is a new task, so a late result of the previous one
+        # can't be mistaken for it.
+        task_id = uuid()
+        for message in retried_messages:
+            message.task_id = task_id
+    MailoutMessage.objects.bulk_update(changed.values(), (
+        'status', 'sent_at', 'attempts', 'task_id',))
+    deltas = defaultdict(Counter)
+    for message in changed.values():
+        if message.status != message._loaded_status:
+            MESSAGE_STATUSES.labels(message.status).inc()
+        deltas[message.mailout_id][message._loaded_status] -= 1
+        deltas[message.mailout_id][message.status] += 1
+        message._loaded_status = message.status
+    for mailout_id, changes in deltas.items():
+        MailoutStats.adjust(mailout_id, changes)
+    for task_id, retried_messages in retried.items():
+        if retried_messages:
+            retry_messages(retried_messages, batches[task_id],
+                           delays[task_id])
+
+
+class StatusIngestor:
+    """
+    Buffers delivery results and applies them in micro-batches: when
+    ``flush_size`` results are queued or ``flush_interval`` seconds after
+    the first of them arrived, whichever comes first.
+    """
+
+    def __init__(self, flush_size, flush_interval):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, result):
+        with self._lock:
+            self._buffer.append(result)
+            full = len(self._buffer) >= self.flush_size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval,
+                                              self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            results, self._buffer = self._buffer, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if results:
+            apply_delivery_results(results)
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            close_old_connections()
+
+
+status_ingestor = StatusIngestor(settings.MAILOUT_STATUS_FLUSH_SIZE,
+                                 settings.MAILOUT_STATUS_FLUSH_INTERVAL)
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def flush_status_ingestor(**kwargs):
+    status_ingestor.flush()
+
+
+@task_success.connect
+def record_direct_status(sender=None, result=None, **kwargs):
+    # With MAILOUT_DIRECT_STATUS the send tasks don't store a TaskResult,
+    # so their outcome goes straight to the ingestor from the worker.
+    # Revoked and failed tasks still store one and reach
+    # record_message_status as before.
+    if not settings.MAILOUT_DIRECT_STATUS or sender.name not in (
+            send_message.name, send_message_batch.name):
+        return
+    status_ingestor.add(parse_return_value(sender.request.id, result))
@@ -0,0 +1,85 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+
+from aiohttp import web
+from django.core.management import BaseCommand
+from django.test import override_settings
+
+from notificationsapp.async_delivery import run_delivery, stop_delivery_loop
+from notificationsapp.tasks import deliver_message, get_session
+
+
+def run_fake_provider(port, latency, started):
+    async def handle(request):
+        await request.read()
+        await asyncio.sleep(latency)
+        return web.json_response({'code': 0, 'message': 'OK'})
+
+    async def serve():
+        app = web.Application()
+        app.router.add_post('/v1/send/{message_id}', handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port, backlog=4096).start()
+        started.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def send_sequentially(messages):
+    session = get_session()
+    return [deliver_message(session, message_id, phone, text)
+            for message_id, phone, text in messages]
+
+
+class Command(BaseCommand):
+    help = 'Compare prefork and asyncio delivery against a local fake provider'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help='fake provider latency, seconds')
+        parser.add_argument('--processes', type=int, default=4,
+                            help='prefork pool size for the sync path')
+        parser.add_argument('--concurrency', type=int, default=200,
+                            help='in-flight requests for the asyncio path')
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        started = threading.Event()
+        threading.Thread(target=run_fake_provider, daemon=True, args=(
+            options['port'], options['latency'], started)).start()
+        started.wait()
+        messages = [(i, 79120000000 + i, 'benchmark')
+                    for i in range(1, options['messages'] + 1)]
+        url = f'http://127.0.0.1:{options["port"]}/v1/send/'
+        with override_settings(SMS_API_URL=url):
+            self.report('prefork x%d' % options['processes'],
+                        *self.run_prefork(messages, options['processes']))
+            self.report('asyncio x%d' % options['concurrency'],
+                        *self.run_async(messages, options['concurrency']))
+
+    def run_prefork(self, messages, processes):
+        chunks = [messages[i::processes] for i in range(processes)]
+        context = multiprocessing.get_context('fork')
+        start = time.perf_counter()
+        with context.Pool(processes) as pool:
+            results = [result for chunk in pool.map(send_sequentially, chunks)
+                       for result in chunk]
+        return results, time.perf_counter() - start
+
+    def run_async(self, messages, concurrency):
+        start = time.perf_counter()
+        with override_settings(SMS_API_ASYNC_CONCURRENCY=concurrency):
+            results = run_delivery(messages, concurrency)
+        stop_delivery_loop()
+        return results, time.perf_counter() - start
+
+    def report(self, label, results, elapsed):
+        failed = sum(1 for result in results if result['code'] != 200)
+        self.stdout.write(
+            '%-16s %6d messages in %7.2fs, %8.1f msg/s, %d failed' % (
+                label, len(results), elapsed, len(results) / elapsed, failed))
@@ -0,0 +1,37 @@
+from django.core.management import BaseCommand, CommandError
+
+from notificationsapp.db_router import replica_reads
+from notificationsapp.exporters import export_report
+from notificationsapp.models import Mailout
+from settings.commons import IMPORT_FORMATS, CSV_FORMAT
+
+
+class Command(BaseCommand):
+    help = 'Stream the per-message delivery report of a mailout as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('mailout_id', type=int)
+        parser.add_argument('--format', choices=dict(IMPORT_FORMATS),
+                            default=CSV_FORMAT)
+        parser.add_argument('--output', help='file to write, stdout if omitted')
+        parser.add_argument('--chunk-size', type=int)
+
+    def handle(self, *args, **options):
+        with replica_reads():
+            self.export(options)
+
+    def export(self, options):
+        try:
+            mailout = Mailout.objects.get(pk=options['mailout_id'])
+        except Mailout.DoesNotExist:
+            raise CommandError(
+                'Mailout %s does not exist' % options['mailout_id'])
+        report = export_report(mailout, options['format'],
+                               options['chunk_size'])
+        if options['output'] is None:
+            for part in report:
+                self.stdout.write(part, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for part in report:
+                output.write(part)
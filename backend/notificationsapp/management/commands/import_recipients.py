@@ -0,0 +1,27 @@
+from django.core.management import BaseCommand
+
+from notificationsapp.importers import import_recipients, read_rows, \
+    guess_format, DECODE_ERRORS
+from settings.commons import IMPORT_FORMATS
+
+
+class Command(BaseCommand):
+    help = 'Bulk import recipients from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=dict(IMPORT_FORMATS))
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or guess_format(options['path'])
+        with open(options['path'], encoding='utf-8-sig', newline='',
+                  errors=DECODE_ERRORS) as lines:
+            report = import_recipients(read_rows(lines, file_format),
+                                       options['batch_size'])
+        for error in report['errors']:
+            self.stderr.write('row %d: %s' % (
+                error['row'], '; '.join(map(str, error['errors']))))
+        self.stdout.write(self.style.SUCCESS(
+            'Created %d recipients, %d rows failed' % (
+                report['created'], report['failed'])))
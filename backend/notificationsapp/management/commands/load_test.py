@@ -0,0 +1,75 @@
+import asyncio
+import statistics
+import time
+
+import aiohttp
+from django.core.management import BaseCommand
+
+
+def percentile(latencies, share):
+    if not latencies:
+        return 0
+    return latencies[min(int(len(latencies) * share), len(latencies) - 1)]
+
+
+async def run_load(base_url, paths, requests, concurrency):
+    queue = asyncio.Queue()
+    for number in range(requests):
+        queue.put_nowait(base_url.rstrip('/') + '/' + paths[
+            number % len(paths)].lstrip('/'))
+    latencies = []
+    errors = 0
+
+    async def worker(session):
+        nonlocal errors
+        while not queue.empty():
+            url = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                async with session.get(url) as resp:
+                    await resp.read()
+                    if resp.status >= 400:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    headers = {'Accept': 'application/json'}
+    started = time.perf_counter()
+    async with aiohttp.ClientSession(connector=connector,
+                                     headers=headers) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    return sorted(latencies), errors, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = 'Compare read latency of deployments (e.g. WSGI and ASGI) under ' \
+           'the same concurrent load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', action='append', required=True,
+                            help='base URL of a deployment, e.g. '
+                                 'http://localhost:8080/api/; repeat to '
+                                 'compare several')
+        parser.add_argument('--path', action='append',
+                            help='endpoint to request, relative to the base '
+                                 'URL; repeat to mix several')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=100)
+
+    def handle(self, *args, **options):
+        paths = options['path'] or ['mailout-list/']
+        for base_url in options['url']:
+            latencies, errors, elapsed = asyncio.run(run_load(
+                base_url, paths, options['requests'],
+                options['concurrency']))
+            self.stdout.write(
+                '%-40s %6d requests in %6.2fs, %8.1f req/s, %d failed, '
+                'p50 %7.1fms, p95 %7.1fms, p99 %7.1fms, mean %7.1fms' % (
+                    base_url, len(latencies), elapsed,
+                    len(latencies) / elapsed, errors,
+                    percentile(latencies, 0.5) * 1000,
+                    percentile(latencies, 0.95) * 1000,
+                    percentile(latencies, 0.99) * 1000,
+                    statistics.mean(latencies or [0]) * 1000))
@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand
+
+from notificationsapp.models import Mailout, MailoutStats
+from notificationsapp.utils import iter_chunks
+
+
+class Command(BaseCommand):
+    help = 'Recount per-mailout message status counters from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('mailout_ids', nargs='*', type=int)
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        mailouts = Mailout.objects.order_by('id')
+        if options['mailout_ids']:
+            mailouts = mailouts.filter(id__in=options['mailout_ids'])
+        rebuilt = 0
+        for chunk in iter_chunks(mailouts.values_list('id', flat=True),
+                                 options['chunk_size']):
+            rebuilt += MailoutStats.rebuild(Mailout.objects.filter(id__in=chunk))
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt counters for %d mailouts' % rebuilt))
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from notificationsapp.profiling import PROFILING_MODES, get_profiling_mode, \
+    set_profiling_mode
+
+DEFAULT_MODE = 'default'
+
+
+class Command(BaseCommand):
+    help = 'Show or switch per-request SQL profiling of the running ' \
+           'servers (shared through the cache, no restart needed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('mode', nargs='?',
+                            choices=PROFILING_MODES + (DEFAULT_MODE,),
+                            help='"%s" goes back to the SQL_PROFILING '
+                                 'setting' % DEFAULT_MODE)
+
+    def handle(self, *args, **options):
+        if options['mode'] is not None:
+            set_profiling_mode(None if options['mode'] == DEFAULT_MODE
+                               else options['mode'])
+        self.stdout.write('SQL profiling: %s (setting: %s, servers pick up '
+                          'changes within %ss)' % (
+                              get_profiling_mode(), settings.SQL_PROFILING,
+                              settings.SQL_PROFILING_REFRESH))
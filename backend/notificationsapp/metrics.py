@@ -0,0 +1,117 @@
+import os
+
+from celery.signals import worker_init, worker_process_shutdown
+from django.conf import settings
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.utils import timezone
+from prometheus_client import Counter, Histogram, CollectorRegistry, \
+    REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess, \
+    start_http_server
+from prometheus_client.core import GaugeMetricFamily
+
+from settings.celery import app
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LAG_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+PROVIDER_LATENCY = Histogram(
+    'notifications_provider_request_seconds',
+    'SMS provider request latency', ('code',), buckets=LATENCY_BUCKETS)
+SENT_MESSAGES = Counter(
+    'notifications_sent_messages',
+    'Messages sent to the SMS provider', ('code', 'prefix',))
+MESSAGE_STATUSES = Counter(
+    'notifications_message_statuses',
+    'Message status changes applied from delivery results', ('status',))
+RETRIED_MESSAGES = Counter(
+    'notifications_retried_messages',
+    'Messages requeued for another attempt', ('reason',))
+FANOUT_DURATION = Histogram(
+    'notifications_fanout_seconds',
+    'Time spent fanning out a created or edited mailout', ('kind',),
+    buckets=LATENCY_BUCKETS)
+FANOUT_MESSAGES = Counter(
+    'notifications_fanout_messages',
+    'Messages created by mailout fan-out')
+INGESTION_LAG = Histogram(
+    'notifications_status_ingestion_lag_seconds',
+    'Time from a delivery result to its status being applied',
+    buckets=LAG_BUCKETS)
+REQUEST_QUERIES = Histogram(
+    'notifications_request_sql_queries',
+    'SQL queries per profiled request', ('view',),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+REQUEST_SQL_DURATION = Histogram(
+    'notifications_request_sql_seconds',
+    'SQL time per profiled request', ('view',), buckets=LATENCY_BUCKETS)
+
+
+def get_prefix(phone):
+    return str(phone)[1:4]
+
+
+def observe_delivery(phone, code, duration):
+    PROVIDER_LATENCY.labels(code).observe(duration)
+    SENT_MESSAGES.labels(code, get_prefix(phone)).inc()
+
+
+class BacklogCollector:
+    # Backlog gauges are read when scraped: broker queue depth from the
+    # broker, and messages waiting for their window from the per-mailout
+    # stats, never from the messages table.
+
+    def collect(self):
+        from notificationsapp.models import MailoutStats
+        queue_depth = GaugeMetricFamily(
+            'notifications_broker_queue_depth',
+            'Tasks ready in the broker queue', labels=('queue',))
+        try:
+            with app.connection_for_read() as connection:
+                # A broker outage mustn't stall the scrape.
+                connection.ensure_connection(max_retries=1, interval_start=0)
+                queue = app.conf.task_default_queue
+                queue_depth.add_metric((queue,), connection.default_channel.
+                                       queue_declare(queue, passive=True).
+                                       message_count)
+        except Exception:
+            pass
+        yield queue_depth
+        backlog = MailoutStats.objects.filter(
+            mailout__datetime_start__gt=timezone.now()).aggregate(
+            total=Sum('pending'))['total']
+        yield GaugeMetricFamily(
+            'notifications_eta_backlog',
+            'Pending messages of mailouts that have not started yet',
+            value=backlog or 0)
+
+
+def get_registry():
+    registry = REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_view(request):
+    backlog = CollectorRegistry()
+    backlog.register(BacklogCollector())
+    return HttpResponse(generate_latest(get_registry()) +
+                        generate_latest(backlog),
+                        content_type=CONTENT_TYPE_LATEST)
+
+
+@worker_init.connect
+def start_worker_exporter(**kwargs):
+    # Worker metrics are served by the main worker process; in
+    # multiprocess mode it aggregates what the pool processes recorded.
+    if settings.METRICS_WORKER_PORT:
+        start_http_server(settings.METRICS_WORKER_PORT,
+                          registry=get_registry())
+
+
+@worker_process_shutdown.connect
+def mark_worker_process_dead(pid=None, **kwargs):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid or os.getpid())
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import logging
+import math
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+
+from notificationsapp.db_router import replica_reads
+from notificationsapp.metrics import REQUEST_QUERIES, REQUEST_SQL_DURATION
+from notificationsapp.profiling import QueryProfile, current_profile, \
+    get_profiling_mode, get_cached_profiling_mode, PROFILING_LOG, \
+    PROFILING_ENFORCE
+
+PRIMARY_PIN_COOKIE = 'db_primary_pin'
+
+logger = logging.getLogger('notificationsapp.sql')
+
+
+def read_from_replicas(content):
+    # Streamed bodies are rendered after the view has returned, so each
+    # chunk has to be read inside replica_reads() again.
+    iterator = iter(content)
+    while True:
+        with replica_reads():
+            try:
+                part = next(iterator)
+            except StopIteration:
+                return
+        yield part
+
+
+class HybridMiddleware:
+    # Runs in the mode of the handler it wraps, so the async views aren't
+    # put back on a thread under ASGI.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Mark the instance as a coroutine function, as Django's own
+            # MiddlewareMixin does.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.handle(request)
+
+
+class ReplicaReadMiddleware(HybridMiddleware):
+    # Read-only requests are served from the replicas. A client that has
+    # just changed something is pinned to the primary for the replication
+    # lag, so it reads its own writes.
+
+    def handle(self, request):
+        if request.method not in SAFE_METHODS:
+            return self.pin_to_primary(self.get_response(request))
+        if PRIMARY_PIN_COOKIE in request.COOKIES:
+            return self.get_response(request)
+        with replica_reads():
+            response = self.get_response(request)
+        return self.stream_from_replicas(response)
+
+    async def __acall__(self, request):
+        if request.method not in SAFE_METHODS:
+            return self.pin_to_primary(await self.get_response(request))
+        if PRIMARY_PIN_COOKIE in request.COOKIES:
+            return await self.get_response(request)
+        with replica_reads():
+            response = await self.get_response(request)
+        return self.stream_from_replicas(response)
+
+    def pin_to_primary(self, response):
+        if settings.DATABASE_REPLICAS and response.status_code < 400:
+            response.set_cookie(
+                PRIMARY_PIN_COOKIE, '1',
+                max_age=math.ceil(settings.DATABASE_REPLICA_LAG),
+                httponly=True, samesite='Lax')
+        return response
+
+    def stream_from_replicas(self, response):
+        if response.streaming:
+            response.streaming_content = read_from_replicas(
+                response.streaming_content)
+        return response
+
+
+class QueryProfilingMiddleware(HybridMiddleware):
+    # Counts and times the SQL of each request while profiling is on,
+    # reporting it in headers, a JSON log line and metrics per view.
+    # Views may declare a query_budget; over it the request is logged as a
+    # warning, or stopped when profiling is in enforce mode. Only read-only
+    # requests are stopped, and only by their view's own budget: a write
+    # stopped halfway would leave part of its changes behind.
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Sync hooks would cost every async request a trip to the sync
+            # thread.
+            self.process_view = self.aprocess_view
+            self.process_template_response = self.aprocess_template_response
+
+    def handle(self, request):
+        mode = get_profiling_mode()
+        if mode not in (PROFILING_LOG, PROFILING_ENFORCE):
+            return self.get_response(request)
+        profile = QueryProfile(enforce=mode == PROFILING_ENFORCE)
+        token = current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        self.report(request, response, profile)
+        return response
+
+    async def __acall__(self, request):
+        # The mode is only read from the cache when it's due a refresh.
+        mode = get_cached_profiling_mode() or await sync_to_async(
+            get_profiling_mode, thread_sensitive=False)()
+        if mode not in (PROFILING_LOG, PROFILING_ENFORCE):
+            return await self.get_response(request)
+        profile = QueryProfile(enforce=mode == PROFILING_ENFORCE)
+        token = current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        self.report(request, response, profile)
+        return response
+
+    async def aprocess_view(self, request, view_func, view_args,
+                            view_kwargs):
+        self.set_budget(request, view_func)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.set_budget(request, view_func)
+
+    async def aprocess_template_response(self, request, response):
+        return self.finish_view(response)
+
+    def process_template_response(self, request, response):
+        return self.finish_view(response)
+
+    def finish_view(self, response):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.finish_view()
+        return response
+
+    def set_budget(self, request, view_func):
+        profile = current_profile.get()
+        if profile is not None:
+            budget = getattr(getattr(view_func, 'cls', view_func),
+                             'query_budget', None)
+            profile.budget = budget or settings.SQL_QUERY_BUDGET or None
+            profile.enforce = profile.enforce and budget is not None and \
+                request.method in SAFE_METHODS
+
+    def report(self, request, response, profile):
+        duration = profile.duration * 1000
+        response['X-SQL-Queries'] = str(profile.queries)
+        response['X-SQL-Time'] = '%.1f' % duration
+        response['Server-Timing'] = 'sql;dur=%.1f;desc="%d queries"' % (
+            duration, profile.queries)
+        view = request.resolver_match.route \
+            if request.resolver_match else ''
+        REQUEST_QUERIES.labels(view).observe(profile.queries)
+        REQUEST_SQL_DURATION.labels(view).observe(profile.duration)
+        logger.log(logging.WARNING if profile.over_budget else logging.INFO,
+                   json.dumps({
+                       'view': view,
+                       'method': request.method,
+                       'path': request.path,
+                       'status': response.status_code,
+                       'queries': profile.queries,
+                       'view_queries': profile.view_queries,
+                       'sql_ms': round(duration, 1),
+                       'budget': profile.budget,
+                       'over_budget': profile.over_budget,
+                       'slowest': profile.get_slowest(),
+                   }))
@@ -0,0 +1,54 @@
+# Generated by Django 4.0.3 on 2022-04-02 14:12
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+STATUS_COUNTERS = {
+    'SUCCESS': 'success',
+    'FAILURE': 'failure',
+    'PENDING': 'pending',
+    'RETRY': 'retry',
+    'REVOKED': 'revoked',
+}
+
+
+def populate_stats(apps, schema_editor):
+    Mailout = apps.get_model('notificationsapp', 'Mailout')
+    MailoutMessage = apps.get_model('notificationsapp', 'MailoutMessage')
+    MailoutStats = apps.get_model('notificationsapp', 'MailoutStats')
+    stats = {mailout_id: MailoutStats(mailout_id=mailout_id)
+             for mailout_id in Mailout.objects.values_list('id', flat=True)}
+    counts = MailoutMessage.objects.filter(
+        status__in=STATUS_COUNTERS).values('mailout_id', 'status').annotate(
+        total=Count('id'))
+    for row in counts:
+        setattr(stats[row['mailout_id']], STATUS_COUNTERS[row['status']],
+                row['total'])
+    MailoutStats.objects.bulk_create(stats.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificationsapp', '0008_alter_mailoutmessage_task_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailoutStats',
+            fields=[
+                ('mailout', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='notificationsapp.mailout', verbose_name='mailout')),
+                ('success', models.IntegerField(default=0, verbose_name='sent successfully')),
+                ('failure', models.IntegerField(default=0, verbose_name='sending failed')),
+                ('pending', models.IntegerField(default=0, verbose_name='pending')),
+                ('retry', models.IntegerField(default=0, verbose_name='retried')),
+                ('revoked', models.IntegerField(default=0, verbose_name='revoked')),
+            ],
+            options={
+                'verbose_name': 'mailout statistics',
+                'verbose_name_plural': 'mailout statistics',
+            },
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
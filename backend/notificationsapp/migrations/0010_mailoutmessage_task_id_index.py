@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2022-04-05 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificationsapp', '0009_mailoutstats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mailoutmessage',
+            name='task_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True, verbose_name='task ID'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.3 on 2022-04-06 09:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificationsapp', '0010_mailoutmessage_task_id_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mailoutrecipient',
+            name='cell_provider_prefix',
+            field=models.CharField(db_index=True, max_length=3, verbose_name='cell provider prefix'),
+        ),
+        migrations.AlterField(
+            model_name='mailoutrecipient',
+            name='tag',
+            field=models.CharField(db_index=True, max_length=100, verbose_name='recipient tags'),
+        ),
+    ]
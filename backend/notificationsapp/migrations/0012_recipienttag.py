@@ -0,0 +1,56 @@
+# Generated by Django 4.0.3 on 2022-04-08 17:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+TAG_SEPARATOR = ','
+
+
+def split_tags(apps, schema_editor):
+    MailoutRecipient = apps.get_model('notificationsapp', 'MailoutRecipient')
+    RecipientTag = apps.get_model('notificationsapp', 'RecipientTag')
+    tags = []
+    for recipient_id, tag in MailoutRecipient.objects.values_list(
+            'id', 'tag').iterator():
+        names = {name.strip() for name in tag.split(TAG_SEPARATOR)}
+        tags.extend(RecipientTag(recipient_id=recipient_id, name=name)
+                    for name in names if name)
+        if len(tags) >= 5000:
+            RecipientTag.objects.bulk_create(tags)
+            tags = []
+    RecipientTag.objects.bulk_create(tags)
+
+
+def join_tags(apps, schema_editor):
+    MailoutRecipient = apps.get_model('notificationsapp', 'MailoutRecipient')
+    for recipient in MailoutRecipient.objects.prefetch_related('tags'):
+        recipient.tag = TAG_SEPARATOR.join(
+            sorted(tag.name for tag in recipient.tags.all()))
+        recipient.save(update_fields=('tag',))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificationsapp', '0011_mailoutrecipient_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipientTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='tag')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tags', to='notificationsapp.mailoutrecipient', verbose_name='recipient')),
+            ],
+            options={
+                'verbose_name': 'recipient tag',
+                'verbose_name_plural': 'recipient tags',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='recipienttag',
+            constraint=models.UniqueConstraint(fields=('name', 'recipient'), name='unique_recipient_tag'),
+        ),
+        migrations.RunPython(split_tags, join_tags),
+    ]
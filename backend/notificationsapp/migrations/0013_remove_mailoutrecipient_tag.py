@@ -0,0 +1,23 @@
+# Generated by Django 4.0.3 on 2022-04-08 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificationsapp', '0012_recipienttag'),
+    ]
+
+    operations = [
+        # A default lets the column be re-added when migrating backwards.
+        migrations.AlterField(
+            model_name='mailoutrecipient',
+            name='tag',
+            field=models.CharField(db_index=True, default='', max_length=100, verbose_name='recipient tags'),
+        ),
+        migrations.RemoveField(
+            model_name='mailoutrecipient',
+            name='tag',
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0.3 on 2022-04-11 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificationsapp', '0013_remove_mailoutrecipient_tag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailoutmessage',
+            name='due_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='due at'),
+        ),
+        migrations.AddIndex(
+            model_name='mailoutmessage',
+            index=models.Index(condition=models.Q(('status', 'SCHEDULED')), fields=['due_at'], name='message_scheduled_due_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2022-04-11 16:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificationsapp', '0014_mailoutmessage_due_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailout',
+            name='local_time',
+            field=models.BooleanField(default=False, verbose_name='local time window'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.3 on 2022-04-12 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificationsapp', '0015_mailout_local_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailoutmessage',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='attempts'),
+        ),
+    ]
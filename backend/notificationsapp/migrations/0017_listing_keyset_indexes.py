@@ -0,0 +1,21 @@
+# Generated by Django 4.0.3 on 2022-04-12 15:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notificationsapp', '0016_mailoutmessage_attempts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mailout',
+            index=models.Index(fields=['-datetime_finish', 'id'], name='mailout_finish_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailoutmessage',
+            index=models.Index(fields=['-sent_at', 'id'], name='message_sent_at_id_idx'),
+        ),
+    ]
@@ -1,17 +1,14 @@
-import json
-from datetime import timedelta
+from collections import Counter
 
-from celery.result import AsyncResult
-from django.db import models
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from django.utils import timezone
-from django_celery_results.models import TaskResult
-from rest_framework import status
+import pytz
+from django.db import models, transaction
+from django.db.models import F, Count
+from django.utils.timezone import localtime
 
+from notificationsapp.caching import touch_mailouts
 from notificationsapp.tasks import send_message
-from settings.commons import FILTER_TYPE, TIMEZONES, TAG, PHONE_PREFIX, \
-    PENDING_STATUS, REVOKE_STATUS, FAILURE_STATUS, SUCCESS_STATUS, RETRY_STATUS
+from settings.commons import FILTER_TYPE, TIMEZONES, PHONE_PREFIX, \
+    PENDING_STATUS, SCHEDULED_STATUS, STATUS_COUNTERS
 
 
 class Mailout(models.Model):
@@ -19,6 +16,10 @@ class Mailout(models.Model):
         verbose_name = 'mailout'
         verbose_name_plural = 'mailouts'
         ordering = ('-datetime_finish',)
+        indexes = (
+            models.Index(fields=('-datetime_finish', 'id',),
+                         name='mailout_finish_id_idx'),
+        )
 
     datetime_start = models.DateTimeField(null=False,
                                           verbose_name='start date')
@@ -30,6 +31,29 @@ class Mailout(models.Model):
                                     verbose_name='filter type')
     filter_value = models.CharField(max_length=100,
                                     verbose_name='filter value')
+    local_time = models.BooleanField(default=False,
+                                     verbose_name='local time window')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = instance.get_tracked_values()
+        return instance
+
+    def get_tracked_values(self):
+        return {field: self.__dict__.get(field) for field in (
+            'text', 'datetime_start', 'datetime_finish', 'filter_field',
+            'filter_value', 'local_time',)}
+
+    def get_window(self, tz_name=None):
+        # A local time mailout runs in the same wall-clock window in every
+        # recipient's timezone.
+        if not self.local_time or tz_name is None:
+            return self.datetime_start, self.datetime_finish
+        tz = pytz.timezone(tz_name)
+        return tuple(tz.localize(localtime(moment).replace(tzinfo=None))
+                     for moment in (self.datetime_start,
+                                    self.datetime_finish))
 
 
 class MailoutRecipient(models.Model):
@@ -39,15 +63,43 @@ class MailoutRecipient(models.Model):
 
     phone = models.CharField(max_length=11,
                              verbose_name="recipient's phone")
-    cell_provider_prefix = models.CharField(max_length=3,
+    cell_provider_prefix = models.CharField(max_length=3, db_index=True,
                                             verbose_name='cell provider prefix')
-    tag = models.CharField(max_length=100, verbose_name='recipient tags')
     timezone = models.CharField(max_length=32, choices=TIMEZONES,
                                 default='UTC',
                                 verbose_name="Recipient's timezone")
 
     def __str__(self):
-        return '%s (tags: %s)' % (self.phone, self.tag)
+        return '%s (tags: %s)' % (
+            self.phone, ', '.join(tag.name for tag in self.tags.all()))
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_segments = instance.get_segments()
+        return instance
+
+    def get_segments(self):
+        # Tag segments are tracked through RecipientTag rows.
+        return ((PHONE_PREFIX, self.__dict__.get('cell_provider_prefix')),)
+
+
+class RecipientTag(models.Model):
+    class Meta:
+        verbose_name = 'recipient tag'
+        verbose_name_plural = 'recipient tags'
+        constraints = (
+            models.UniqueConstraint(fields=('name', 'recipient',),
+                                    name='unique_recipient_tag'),
+        )
+
+    recipient = models.ForeignKey(MailoutRecipient, on_delete=models.CASCADE,
+                                  related_name='tags',
+                                  verbose_name='recipient')
+    name = models.CharField(max_length=100, verbose_name='tag')
+
+    def __str__(self):
+        return self.name
 
 
 class MailoutMessage(models.Model):
@@ -55,6 +107,13 @@ class MailoutMessage(models.Model):
         verbose_name = 'message'
         verbose_name_plural = 'messages'
         ordering = ('-sent_at',)
+        indexes = (
+            models.Index(fields=('-sent_at', 'id',),
+                         name='message_sent_at_id_idx'),
+            models.Index(fields=('due_at',),
+                         condition=models.Q(status=SCHEDULED_STATUS),
+                         name='message_scheduled_due_idx'),
+        )
 
     sent_at = models.DateTimeField(null=True, blank=True,
                                    verbose_name='sent at')
@@ -67,68 +126,79 @@ class MailoutMessage(models.Model):
                                   related_name='message_recipient',
                                   verbose_name='message recipient')
     task_id = models.CharField(max_length=100, blank=True, null=True,
-                               verbose_name='task ID')
+                               db_index=True, verbose_name='task ID')
+    due_at = models.DateTimeField(null=True, blank=True,
+                                  verbose_name='due at')
+    attempts = models.PositiveSmallIntegerField(default=0,
+                                                verbose_name='attempts')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def get_window(self):
+        return self.mailout.get_window(self.recipient.timezone)
 
     def apply_async_task(self):
+        start, finish = self.get_window()
         result = send_message.apply_async(
             args=(self.id, self.recipient.phone, self.mailout.text),
-            eta=self.mailout.datetime_start,
-            expires=self.mailout.datetime_finish
+            kwargs={'mailout_id': self.mailout_id},
+            eta=start,
+            expires=finish
         )
         self.task_id = result.id
         self.status = PENDING_STATUS
         self.save()
 
 
-@receiver(post_save, sender=Mailout)
-def add_mailout_task(sender, instance, created, **kwargs):
-    recipients = []
-    if instance.filter_field == TAG:
-        recipients = MailoutRecipient.objects.filter(
-            tag=instance.filter_value)
-    if instance.filter_field == PHONE_PREFIX:
-        recipients = MailoutRecipient.objects.filter(
-            cell_provider_prefix=instance.filter_value)
-    try:
-        messages = MailoutMessage.objects.filter(mailout=instance).all()
-        if not messages.exists():
-            raise MailoutMessage.DoesNotExist
-    except MailoutMessage.DoesNotExist:
-        for recipient in recipients:
-            message = MailoutMessage.objects.create(mailout=instance,
-                                                    recipient=recipient)
-            message.save()
-            message.apply_async_task()
-    else:
-        for message in messages:
-            AsyncResult(message.task_id).revoke()
-            if message.status != SUCCESS_STATUS:
-                message.delete()
-        for recipient in recipients:
-            message = MailoutMessage.objects.create(mailout=instance,
-                                                    recipient=recipient)
-            message.save()
-            message.apply_async_task()
-
-
-@receiver(post_save, sender=TaskResult)
-def record_message_status(sender, instance, created, **kwargs):
-    delay = timedelta(minutes=10)
-    message = MailoutMessage.objects.get(task_id=instance.task_id)
-    result_string = json.loads(instance.result)
-    result_code = result_string.get('code')
-    if result_code == status.HTTP_200_OK:
-        message.status = SUCCESS_STATUS
-        message.sent_at = instance.date_created
-    if result_code == status.HTTP_400_BAD_REQUEST:
-        if timezone.now() + delay <= message.mailout.datetime_finish:
-            message.status = RETRY_STATUS
-            send_message.apply_async(args=(
-                message.id, message.recipient.phone, message.mailout.text),
-                eta=timezone.now() + delay,
-                expires=message.mailout.datetime_finish,
-                task_id=instance.task_id
-            )
-    if instance.status == REVOKE_STATUS:
-        message.status = FAILURE_STATUS
-    message.save()
+
+class MailoutStats(models.Model):
+    class Meta:
+        verbose_name = 'mailout statistics'
+        verbose_name_plural = 'mailout statistics'
+
+    mailout = models.OneToOneField(Mailout, on_delete=models.CASCADE,
+                                   primary_key=True, related_name='stats',
+                                   verbose_name='mailout')
+    success = models.IntegerField(default=0, verbose_name='sent successfully')
+    failure = models.IntegerField(default=0, verbose_name='sending failed')
+    pending = models.IntegerField(default=0, verbose_name='pending')
+    retry = models.IntegerField(default=0, verbose_name='retried')
+    revoked = models.IntegerField(default=0, verbose_name='revoked')
+
+    @classmethod
+    def adjust(cls, mailout_id, changes):
+        deltas = Counter()
+        for status, delta in changes.items():
+            field = STATUS_COUNTERS.get(status)
+            if field:
+                deltas[field] += delta
+        counters = {field: F(field) + delta
+                    for field, delta in deltas.items() if delta}
+        if counters:
+            cls.objects.filter(mailout_id=mailout_id).update(**counters)
+            touch_mailouts((mailout_id,))
+
+    @classmethod
+    def rebuild(cls, mailouts=None):
+        mailouts = Mailout.objects.all() if mailouts is None else mailouts
+        mailout_ids = list(mailouts.values_list('id', flat=True))
+        counts = MailoutMessage.objects.filter(
+            mailout_id__in=mailout_ids,
+            status__in=STATUS_COUNTERS).values(
+            'mailout_id', 'status').annotate(total=Count('id'))
+        stats = {mailout_id: cls(mailout_id=mailout_id)
+                 for mailout_id in mailout_ids}
+        for row in counts:
+            mailout_stats = stats[row['mailout_id']]
+            field = STATUS_COUNTERS[row['status']]
+            setattr(mailout_stats, field,
+                    getattr(mailout_stats, field) + row['total'])
+        with transaction.atomic():
+            cls.objects.filter(mailout_id__in=mailout_ids).delete()
+            cls.objects.bulk_create(stats.values())
+        touch_mailouts(mailout_ids)
+        return len(stats)
@@ -0,0 +1,135 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    # Pages are fetched with a WHERE on the last row's sort key instead of
+    # an OFFSET, and without counting the table. Only forward links are
+    # given. Sort fields may be nullable (NULLs sort as the largest value,
+    # as PostgreSQL indexes them by default); the last one must be
+    # unique. Passing ?page= switches back to page-number pagination.
+    ordering = ('id',)
+    invalid_cursor_message = 'Invalid cursor'
+    page_query_param = 'page'
+
+    def get_order_by(self):
+        order_by = []
+        for field in self.ordering:
+            expression = F(field.lstrip('-'))
+            if field.startswith('-'):
+                order_by.append(expression.desc(nulls_first=True))
+            else:
+                order_by.append(expression.asc(nulls_last=True))
+        return order_by
+
+    def get_fields(self, queryset):
+        return [(queryset.model._meta.get_field(field.lstrip('-')),
+                 field.startswith('-')) for field in self.ordering]
+
+    def encode_cursor(self, values):
+        # isoformat() keeps the microseconds DjangoJSONEncoder drops.
+        cursor = json.dumps([value.isoformat() if isinstance(
+            value, datetime) else value for value in values])
+        return urlsafe_b64encode(cursor.encode()).decode()
+
+    def decode_cursor(self, request, fields):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            values = json.loads(urlsafe_b64decode(encoded.encode()))
+            if len(values) != len(fields):
+                raise ValueError
+            return [None if value is None else field.to_python(value)
+                    for (field, _), value in zip(fields, values)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_after_filter(self, fields, values):
+        condition = Q(pk__in=[])
+        equal = Q()
+        for (field, descending), value in zip(fields, values):
+            if value is None:
+                if descending:
+                    condition |= equal & Q(**{field.name + '__isnull': False})
+                equal &= Q(**{field.name + '__isnull': True})
+                continue
+            lookup = '__lt' if descending else '__gt'
+            after = Q(**{field.name + lookup: value})
+            if field.null and not descending:
+                after |= Q(**{field.name + '__isnull': True})
+            condition |= equal & after
+            equal &= Q(**{field.name: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = queryset.order_by(*self.get_order_by())
+        if self.page_query_param in request.query_params:
+            self.page_number_paginator = PageNumberPagination()
+            return self.page_number_paginator.paginate_queryset(
+                queryset, request, view)
+        self.page_number_paginator = None
+        self.display_page_controls = True
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        fields = self.get_fields(queryset)
+        values = self.decode_cursor(request, fields)
+        if values is not None:
+            queryset = queryset.filter(self.get_after_filter(fields, values))
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        self.next_values = None
+        if len(results) > self.page_size:
+            self.next_values = [getattr(self.page[-1], field.attname)
+                                for field, _ in fields]
+        return self.page
+
+    def get_next_link(self):
+        if self.next_values is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   self.encode_cursor(self.next_values))
+
+    def get_previous_link(self):
+        return None
+
+    def get_paginated_response(self, data):
+        if self.page_number_paginator is not None:
+            return self.page_number_paginator.get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def to_html(self):
+        if self.page_number_paginator is not None:
+            return self.page_number_paginator.to_html()
+        return super().to_html()
+
+    def get_schema_fields(self, view):
+        return super().get_schema_fields(view) + \
+            PageNumberPagination().get_schema_fields(view)
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + \
+            PageNumberPagination().get_schema_operation_parameters(view)
+
+
+class MailoutPagination(KeysetPagination):
+    ordering = ('-datetime_finish', 'id',)
+
+
+class MessagePagination(KeysetPagination):
+    ordering = ('-sent_at', 'id',)
@@ -0,0 +1,118 @@
+import heapq
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.exceptions import APIException
+
+PROFILING_OFF = 'off'
+PROFILING_LOG = 'log'
+PROFILING_ENFORCE = 'enforce'
+PROFILING_MODES = (PROFILING_OFF, PROFILING_LOG, PROFILING_ENFORCE,)
+PROFILING_MODE_KEY = 'sql-profiling:mode'
+SLOWEST_STATEMENTS = 5
+STATEMENT_LENGTH = 500
+
+current_profile = ContextVar('current_profile', default=None)
+_mode = (None, 0)
+
+
+class QueryBudgetExceeded(APIException):
+    default_detail = 'Query budget exceeded.'
+    default_code = 'query_budget_exceeded'
+
+
+def get_cached_profiling_mode():
+    # The mode last read from the cache, None once it's due a refresh.
+    mode, checked_at = _mode
+    if time.monotonic() - checked_at > settings.SQL_PROFILING_REFRESH:
+        return None
+    return mode
+
+
+def get_profiling_mode():
+    # The mode can be switched at runtime through the shared cache; every
+    # process picks a switch up within SQL_PROFILING_REFRESH seconds.
+    global _mode
+    mode = get_cached_profiling_mode()
+    if mode is None:
+        mode = cache.get(PROFILING_MODE_KEY) or settings.SQL_PROFILING
+        _mode = (mode, time.monotonic())
+    return mode
+
+
+def set_profiling_mode(mode):
+    global _mode
+    if mode is None:
+        cache.delete(PROFILING_MODE_KEY)
+    else:
+        cache.set(PROFILING_MODE_KEY, mode, None)
+    _mode = (None, 0)
+
+
+class QueryProfile:
+
+    def __init__(self, budget=None, enforce=False):
+        self.budget = budget
+        self.enforce = enforce
+        self.queries = 0
+        self.duration = 0
+        self.slowest = []
+        self.stopped = False
+        self.view_queries = None
+
+    @property
+    def over_budget(self):
+        queries = self.queries if self.view_queries is None \
+            else self.view_queries
+        return self.stopped or \
+            self.budget is not None and queries > self.budget
+
+    def finish_view(self):
+        # Only the view's queries count towards the budget, not those of
+        # rendering (the browsable API's forms among them).
+        self.view_queries = self.queries
+
+    def record(self, sql, duration):
+        self.queries += 1
+        self.duration += duration
+        statement = (duration, self.queries, sql[:STATEMENT_LENGTH])
+        if len(self.slowest) < SLOWEST_STATEMENTS:
+            heapq.heappush(self.slowest, statement)
+        else:
+            heapq.heappushpop(self.slowest, statement)
+
+    def check_budget(self):
+        # Enforced budgets stop the request at the first query past them.
+        if self.enforce and self.view_queries is None and \
+                self.budget is not None and self.queries >= self.budget:
+            self.stopped = True
+            raise QueryBudgetExceeded(
+                'Query budget of %s exceeded' % self.budget)
+
+    def get_slowest(self):
+        return [{'sql': sql, 'ms': round(duration * 1000, 2)}
+                for duration, _, sql in sorted(self.slowest, reverse=True)]
+
+
+def profile_query(execute, sql, params, many, context):
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    profile.check_budget()
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record(sql, time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def install_query_profiler(sender, connection, **kwargs):
+    # Installed on every connection, so queries run from executor threads
+    # (async views) are counted for the request whose context they carry.
+    if profile_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_query)
@@ -0,0 +1,141 @@
+import threading
+import time
+
+import redis
+from celery.signals import worker_process_init
+from django.conf import settings
+
+MIN_RATE_FACTOR = 0.05
+GLOBAL_BUCKET = 'ratelimit:sms-api'
+PREFIX_BUCKET = 'ratelimit:sms-api:%s'
+RATE_FACTOR_KEY = 'ratelimit:sms-api:factor'
+
+# KEYS[1] is the rate factor, the rest are buckets with their rates in
+# ARGV. A token is always reserved; the reply is how long the caller has
+# to wait before using it.
+ACQUIRE_SCRIPT = '''
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local factor = tonumber(redis.call('GET', KEYS[1]) or '1')
+local wait = 0
+for i = 2, #KEYS do
+    local rate = tonumber(ARGV[i - 1]) * factor
+    local capacity = math.max(rate, 1)
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate) - 1
+    redis.call('HSET', KEYS[i], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[i], math.ceil((capacity - tokens) / rate) + 1)
+    if tokens < 0 then
+        wait = math.max(wait, -tokens / rate)
+    end
+end
+return tostring(wait)
+'''
+
+THROTTLE_SCRIPT = '''
+local factor = tonumber(redis.call('GET', KEYS[1]) or '1')
+factor = math.max(factor / 2, tonumber(ARGV[1]))
+redis.call('SET', KEYS[1], tostring(factor), 'EX', ARGV[2])
+return tostring(factor)
+'''
+
+_limiter = None
+
+
+def get_buckets(phone):
+    buckets = []
+    if settings.SMS_API_RATE_LIMIT:
+        buckets.append((GLOBAL_BUCKET, settings.SMS_API_RATE_LIMIT))
+    if settings.SMS_API_PREFIX_RATE_LIMIT:
+        buckets.append((PREFIX_BUCKET % str(phone)[1:4],
+                        settings.SMS_API_PREFIX_RATE_LIMIT))
+    return buckets
+
+
+class RedisRateLimiter:
+    # Buckets live in Redis so every worker draws from the same tokens.
+
+    def __init__(self, url):
+        client = redis.Redis.from_url(url)
+        self.acquire_script = client.register_script(ACQUIRE_SCRIPT)
+        self.throttle_script = client.register_script(THROTTLE_SCRIPT)
+
+    def acquire(self, phone):
+        buckets = get_buckets(phone)
+        if not buckets:
+            return 0
+        keys, rates = zip(*buckets)
+        return float(self.acquire_script(keys=(RATE_FACTOR_KEY,) + keys,
+                                         args=rates))
+
+    def throttle(self):
+        return float(self.throttle_script(
+            keys=(RATE_FACTOR_KEY,),
+            args=(MIN_RATE_FACTOR, settings.SMS_API_THROTTLE_COOLDOWN)))
+
+
+class LocalRateLimiter:
+    # Same buckets within a single process, for setups without Redis.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.factor = 1
+        self.factor_expires = 0
+
+    def get_factor(self, now):
+        if now >= self.factor_expires:
+            self.factor = 1
+        return self.factor
+
+    def acquire(self, phone):
+        wait = 0
+        with self.lock:
+            now = time.monotonic()
+            factor = self.get_factor(now)
+            for key, rate in get_buckets(phone):
+                rate *= factor
+                capacity = max(rate, 1)
+                tokens, ts = self.buckets.get(key, (capacity, now))
+                tokens = min(capacity, tokens + (now - ts) * rate) - 1
+                self.buckets[key] = (tokens, now)
+                if tokens < 0:
+                    wait = max(wait, -tokens / rate)
+        return wait
+
+    def throttle(self):
+        with self.lock:
+            now = time.monotonic()
+            self.factor = max(self.get_factor(now) / 2, MIN_RATE_FACTOR)
+            self.factor_expires = now + settings.SMS_API_THROTTLE_COOLDOWN
+            return self.factor
+
+
+def get_rate_limiter():
+    global _limiter
+    if _limiter is None:
+        if settings.SMS_API_RATE_LIMIT_URL:
+            _limiter = RedisRateLimiter(settings.SMS_API_RATE_LIMIT_URL)
+        else:
+            _limiter = LocalRateLimiter()
+    return _limiter
+
+
+@worker_process_init.connect
+def reset_rate_limiter(**kwargs):
+    global _limiter
+    _limiter = None
+
+
+def wait_for_slot(phone):
+    wait = get_rate_limiter().acquire(phone)
+    if wait:
+        time.sleep(wait)
+
+
+def report_throttle():
+    # Every throttled response halves the rate of all workers; full
+    # speed comes back once SMS_API_THROTTLE_COOLDOWN passes without one.
+    return get_rate_limiter().throttle()
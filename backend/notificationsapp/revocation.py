@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from notificationsapp.utils import iter_chunks
+from settings.celery import app
+from settings.commons import LOCAL_TIME_SPREAD
+
+CANCELLATION_GRACE = 60
+
+
+def revoke_tasks(task_ids):
+    # One broadcast per MAILOUT_REVOKE_BATCH_SIZE task IDs instead of
+    # one per task.
+    task_ids = sorted(set(task_ids) - {None, ''})
+    for chunk in iter_chunks(task_ids, settings.MAILOUT_REVOKE_BATCH_SIZE):
+        app.control.revoke(chunk)
+
+
+def cancellation_key(mailout_id):
+    return 'mailout-cancelled:%s' % mailout_id
+
+
+def cancel_mailout(mailout):
+    # Workers check the marker before sending, so a deleted mailout needs
+    # no per-task revokes. It lives until the last task has expired.
+    finish = mailout.datetime_finish
+    if mailout.local_time:
+        finish += LOCAL_TIME_SPREAD
+    timeout = (finish - timezone.now()).total_seconds()
+    cache.set(cancellation_key(mailout.id), True,
+              max(timeout, 0) + CANCELLATION_GRACE)
+
+
+def is_mailout_cancelled(mailout_id):
+    if mailout_id is None:
+        return False
+    return cache.get(cancellation_key(mailout_id), False)
@@ -0,0 +1,61 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from notificationsapp.db_router import reading_from_replicas
+from notificationsapp.models import MailoutRecipient, RecipientTag
+from settings.commons import TAG, PHONE_PREFIX
+
+
+def get_segment_recipients(filter_field, filter_value):
+    if filter_field == TAG:
+        return MailoutRecipient.objects.filter(tags__name=filter_value)
+    if filter_field == PHONE_PREFIX:
+        return MailoutRecipient.objects.filter(
+            cell_provider_prefix=filter_value)
+    return MailoutRecipient.objects.none()
+
+
+def segment_key(filter_field, filter_value):
+    digest = hashlib.md5(filter_value.encode()).hexdigest()
+    return 'segment:%s:%s' % (filter_field, digest)
+
+
+def get_segment(filter_field, filter_value):
+    # Recipient IDs are only kept for segments of up to
+    # MAILOUT_SEGMENT_CACHE_MAX_SIZE recipients; bigger ones cache just
+    # their size and are streamed from the database on fan-out. Segments
+    # read from a replica may miss recent recipients, so they aren't
+    # cached for the fan-out to reuse. Without a shared cache nothing is,
+    # as other processes couldn't invalidate it.
+    key = segment_key(filter_field, filter_value)
+    segment = cache.get(key) if settings.CACHE_SHARED else None
+    if segment is None:
+        recipients = get_segment_recipients(filter_field, filter_value)
+        limit = settings.MAILOUT_SEGMENT_CACHE_MAX_SIZE
+        ids = list(recipients.order_by('id').values_list(
+            'id', flat=True)[:limit + 1])
+        if len(ids) > limit:
+            segment = {'size': recipients.count(), 'ids': None}
+        else:
+            segment = {'size': len(ids), 'ids': ids}
+        if settings.CACHE_SHARED and not reading_from_replicas():
+            cache.set(key, segment, settings.MAILOUT_SEGMENT_CACHE_TIMEOUT)
+    return segment
+
+
+def invalidate_segments(segments):
+    cache.delete_many([segment_key(filter_field, filter_value)
+                       for filter_field, filter_value in segments])
+
+
+def set_recipient_tags(recipient, names):
+    names = set(names)
+    current = set(recipient.tags.values_list('name', flat=True))
+    # Deleted tags invalidate their segments through post_delete.
+    recipient.tags.filter(name__in=current - names).delete()
+    RecipientTag.objects.bulk_create(
+        [RecipientTag(recipient=recipient, name=name)
+         for name in names - current])
+    invalidate_segments((TAG, name) for name in names - current)
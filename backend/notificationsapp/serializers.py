@@ -1,14 +1,34 @@
-from django.db.models import Q
 from drf_yasg import openapi
 from rest_framework import serializers
 
 from notificationsapp.models import MailoutRecipient, Mailout, MailoutMessage
-from settings.commons import TIMEZONES, FILTER_TYPE, SUCCESS_STATUS, \
-    FAILURE_STATUS, PENDING_STATUS, RETRY_STATUS, REVOKE_STATUS
+from notificationsapp.segments import set_recipient_tags
+from settings.commons import TIMEZONES, FILTER_TYPE, IMPORT_FORMATS, \
+    TAG_SEPARATOR, CSV_FORMAT
 
 PHONE_NUMBER_LEN = 11
 
 
+def get_message_counts(mailout):
+    stats = getattr(mailout, 'stats', None)
+    return {
+        'sent successfully': stats.success if stats else 0,
+        'sending failed': stats.failure if stats else 0,
+        'pending': stats.pending if stats else 0,
+        'retried': stats.retry if stats else 0,
+        'revoked': stats.revoked if stats else 0
+    }
+
+
+def validate_recipient_phone(phone, prefix):
+    if not phone.lower().startswith('7') or len(phone) != PHONE_NUMBER_LEN:
+        raise serializers.ValidationError(
+            'Incorrect phone number provided!')
+    if prefix != phone[1:4]:
+        raise serializers.ValidationError(
+            'Prefix must correspond to the one in the phone number!')
+
+
 def validate_datetime(data):
     start = data.get('datetime_start')
     finish = data.get('datetime_finish')
@@ -17,10 +37,41 @@ def validate_datetime(data):
     return data
 
 
-class RecipientSerializer(serializers.ModelSerializer):
+class TagListField(serializers.ListField):
+    child = serializers.CharField(max_length=100)
+
+    def to_representation(self, data):
+        return [tag.name for tag in data.all()]
+
+
+class RecipientTagsMixin:
+    def pop_tags(self, data):
+        tags = set(data.pop('tags', ()))
+        tag = data.pop('tag', '')
+        tags.update(name.strip() for name in tag.split(TAG_SEPARATOR))
+        tags.discard('')
+        return tags
+
+    def create(self, validated_data):
+        tags = self.pop_tags(validated_data)
+        recipient = super().create(validated_data)
+        set_recipient_tags(recipient, tags)
+        return recipient
+
+    def update(self, instance, validated_data):
+        tags = self.pop_tags(validated_data)
+        recipient = super().update(instance, validated_data)
+        if tags:
+            set_recipient_tags(recipient, tags)
+        return recipient
+
+
+class RecipientSerializer(RecipientTagsMixin, serializers.ModelSerializer):
     phone = serializers.CharField(max_length=11)
     cell_provider_prefix = serializers.CharField(max_length=3)
-    tag = serializers.CharField(max_length=100)
+    tags = TagListField(required=False)
+    tag = serializers.CharField(max_length=100, write_only=True,
+                                required=False)
     timezone = serializers.ChoiceField(choices=TIMEZONES)
 
     class Meta:
@@ -28,21 +79,22 @@ class RecipientSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
     def validate(self, data):
-        phone = data.get('phone')
-        prefix = data.get('cell_provider_prefix')
-        if not phone.lower().startswith('7') or len(phone) != PHONE_NUMBER_LEN:
-            raise serializers.ValidationError(
-                'Incorrect phone number provided!')
-        if prefix != phone[1:4]:
+        validate_recipient_phone(data.get('phone'),
+                                 data.get('cell_provider_prefix'))
+        if not data.get('tags') and not data.get('tag', '').strip(
+                TAG_SEPARATOR + ' '):
             raise serializers.ValidationError(
-                'Prefix must correspond to the one in the phone number!')
+                'At least one tag must be provided!')
         return data
 
 
-class RecipientPatchSerializer(serializers.ModelSerializer):
+class RecipientPatchSerializer(RecipientTagsMixin,
+                               serializers.ModelSerializer):
     phone = serializers.CharField(max_length=11, required=False)
     cell_provider_prefix = serializers.CharField(max_length=3, required=False)
-    tag = serializers.CharField(max_length=100, required=False)
+    tags = TagListField(required=False)
+    tag = serializers.CharField(max_length=100, write_only=True,
+                                required=False)
     timezone = serializers.ChoiceField(choices=TIMEZONES, required=False)
 
     class Meta:
@@ -73,22 +125,46 @@ class RecipientPatchSerializer(serializers.ModelSerializer):
         return data
 
 
+class RecipientImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=IMPORT_FORMATS, required=False)
+
+
 class RecipientDeleteSerializer(serializers.ModelSerializer):
     class Meta:
         model = MailoutRecipient
 
 
+class ReportExportSerializer(serializers.Serializer):
+    file_format = serializers.ChoiceField(choices=IMPORT_FORMATS,
+                                          default=CSV_FORMAT)
+
+
+class AudiencePreviewSerializer(serializers.Serializer):
+    filter_field = serializers.ChoiceField(choices=FILTER_TYPE)
+    filter_value = serializers.CharField(max_length=100)
+
+
+class CohortSerializer(serializers.Serializer):
+    utc_offset = serializers.CharField()
+    datetime_start = serializers.DateTimeField()
+    datetime_finish = serializers.DateTimeField()
+    timezones = serializers.ListField(child=serializers.CharField())
+    recipients = serializers.IntegerField()
+
+
 class MailoutSerializer(serializers.ModelSerializer):
     datetime_start = serializers.DateTimeField()
     datetime_finish = serializers.DateTimeField()
     text = serializers.CharField(max_length=2500)
     filter_field = serializers.ChoiceField(choices=FILTER_TYPE)
     filter_value = serializers.CharField(max_length=100)
+    local_time = serializers.BooleanField(required=False)
 
     class Meta:
         model = Mailout
         fields = ('datetime_start', 'datetime_finish', 'text', 'filter_field',
-                  'filter_value',)
+                  'filter_value', 'local_time',)
 
     def validate(self, data):
         return validate_datetime(data)
@@ -100,11 +176,12 @@ class MailoutPatchSerializer(serializers.ModelSerializer):
     text = serializers.CharField(max_length=2500, required=False)
     filter_field = serializers.ChoiceField(choices=FILTER_TYPE, required=False)
     filter_value = serializers.CharField(max_length=100, required=False)
+    local_time = serializers.BooleanField(required=False)
 
     class Meta:
         model = Mailout
         fields = ('datetime_start', 'datetime_finish', 'text', 'filter_field',
-                  'filter_value',)
+                  'filter_value', 'local_time',)
 
     def validate(self, data):
         start = data.get('datetime_start', '')
@@ -113,6 +190,8 @@ class MailoutPatchSerializer(serializers.ModelSerializer):
             data['datetime_finish'] = self.instance.datetime_finish
         if finish and not start:
             data['datetime_start'] = self.instance.datetime_start
+        if not start and not finish:
+            return data
         return validate_datetime(data)
 
 
@@ -154,6 +233,10 @@ class MailoutListSerializer(serializers.ModelSerializer):
                     min_length=1,
                     max_length=100
                 ),
+                "local_time": openapi.Schema(
+                    title="Local time window",
+                    type=openapi.TYPE_BOOLEAN
+                ),
                 "messages": openapi.Schema(
                     type=openapi.TYPE_OBJECT,
                     properties={
@@ -179,24 +262,7 @@ class MailoutListSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         rep = super().to_representation(instance)
-        successful_messages = MailoutMessage.objects.filter(
-            Q(mailout=instance.id) & Q(status=SUCCESS_STATUS)).all().count()
-        failed_messages = MailoutMessage.objects.filter(
-            Q(mailout=instance.id) & Q(status=FAILURE_STATUS)).all().count()
-        pending_messages = MailoutMessage.objects.filter(
-            Q(mailout=instance.id) & Q(status=PENDING_STATUS)).all().count()
-        retried_messages = MailoutMessage.objects.filter(
-            Q(mailout=instance.id) & Q(status=RETRY_STATUS)).all().count()
-        revoked_messages = MailoutMessage.objects.filter(
-            Q(mailout=instance.id) & Q(status=REVOKE_STATUS)).all().count()
-        messages_dict = {
-            'sent successfully': successful_messages,
-            'sending failed': failed_messages,
-            'pending': pending_messages,
-            'retried': retried_messages,
-            'revoked': revoked_messages
-        }
-        rep['messages'] = messages_dict
+        rep['messages'] = get_message_counts(instance)
         return rep
 
 
@@ -211,7 +277,7 @@ class MailoutMessageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = MailoutMessage
-        fields = ('id', 'sent_at', 'status', 'recipient',)
+        fields = ('id', 'sent_at', 'status', 'attempts', 'recipient',)
 
 
 class MailoutMessagePostSerializer(serializers.ModelSerializer):
@@ -220,13 +286,29 @@ class MailoutMessagePostSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class MailoutMessageListSerializer(serializers.ModelSerializer):
+    phone = serializers.CharField(source='recipient.phone', read_only=True)
+
+    class Meta:
+        model = MailoutMessage
+        fields = ('id', 'sent_at', 'status', 'attempts', 'recipient_id',
+                  'phone',)
+
+
 class MailoutDetailSerializer(serializers.ModelSerializer):
-    mailout_message = MailoutMessageSerializer(many=True, read_only=True)
+    mailout_messages = serializers.HyperlinkedIdentityField(
+        view_name='mailout-messages')
 
     class Meta:
         model = Mailout
         fields = ('id', 'text', 'datetime_start', 'datetime_finish',
-                  'filter_field', 'filter_value', 'mailout_message',)
+                  'filter_field', 'filter_value', 'local_time',
+                  'mailout_messages',)
+
+    def to_representation(self, instance):
+        rep = super().to_representation(instance)
+        rep['messages'] = get_message_counts(instance)
+        return rep
 
 
 class MailoutManageSerializer(serializers.ModelSerializer):
@@ -239,4 +321,10 @@ class MailoutManageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Mailout
         fields = ('id', 'text', 'datetime_start', 'datetime_finish',
-                  'filter_field', 'filter_value', 'mailout_message',)
+                  'filter_field', 'filter_value', 'local_time',
+                  'mailout_message',)
+
+    def to_representation(self, instance):
+        rep = super().to_representation(instance)
+        rep['messages'] = get_message_counts(instance)
+        return rep
@@ -0,0 +1,79 @@
+from collections import Counter, defaultdict
+
+from django.db.models import Count
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from django_celery_results.models import TaskResult
+
+from notificationsapp.caching import touch_mailouts
+from notificationsapp.fanout import fan_out_mailout, reconcile_mailout
+from notificationsapp.ingestion import status_ingestor, parse_task_result
+from notificationsapp.metrics import FANOUT_DURATION
+from notificationsapp.models import Mailout, MailoutMessage, MailoutStats, \
+    MailoutRecipient, RecipientTag
+from notificationsapp.segments import invalidate_segments
+from settings.commons import TAG
+
+
+@receiver(post_save, sender=Mailout)
+def add_mailout_task(sender, instance, created, **kwargs):
+    if created:
+        with FANOUT_DURATION.labels('create').time():
+            MailoutStats.objects.create(mailout=instance)
+            fan_out_mailout(instance)
+    else:
+        with FANOUT_DURATION.labels('update').time():
+            reconcile_mailout(instance,
+                              getattr(instance, '_loaded_values', {}))
+    instance._loaded_values = instance.get_tracked_values()
+    touch_mailouts((instance.id,))
+
+
+@receiver(post_delete, sender=Mailout)
+def invalidate_deleted_mailout(sender, instance, **kwargs):
+    touch_mailouts((instance.id,))
+
+
+@receiver(post_save, sender=MailoutMessage)
+def track_message_status(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, '_loaded_status', None)
+    if previous != instance.status:
+        MailoutStats.adjust(instance.mailout_id,
+                            {previous: -1, instance.status: 1})
+    instance._loaded_status = instance.status
+
+
+@receiver(post_save, sender=MailoutRecipient)
+def invalidate_recipient_segments(sender, instance, created, **kwargs):
+    segments = set(instance.get_segments())
+    if not created:
+        segments.update(getattr(instance, '_loaded_segments', ()))
+    invalidate_segments(segments)
+    instance._loaded_segments = instance.get_segments()
+
+
+@receiver(pre_delete, sender=MailoutRecipient)
+def adjust_deleted_recipient_stats(sender, instance, **kwargs):
+    # The recipient's messages go with it in a cascade that sends no
+    # signals, so their counters are taken off here.
+    changes = defaultdict(Counter)
+    for row in MailoutMessage.objects.filter(recipient=instance).values(
+            'mailout_id', 'status').annotate(total=Count('id')):
+        changes[row['mailout_id']][row['status']] -= row['total']
+    for mailout_id, mailout_changes in changes.items():
+        MailoutStats.adjust(mailout_id, mailout_changes)
+
+
+@receiver(post_delete, sender=MailoutRecipient)
+def invalidate_deleted_recipient_segments(sender, instance, **kwargs):
+    invalidate_segments(instance.get_segments())
+
+
+@receiver(post_delete, sender=RecipientTag)
+def invalidate_deleted_tag_segment(sender, instance, **kwargs):
+    invalidate_segments(((TAG, instance.name),))
+
+
+@receiver(post_save, sender=TaskResult)
+def record_message_status(sender, instance, created, **kwargs):
+    status_ingestor.add(parse_task_result(instance))
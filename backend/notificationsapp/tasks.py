@@ -1,25 +1,132 @@
 import json
 import os
+import time
 
 import requests
+from celery.signals import worker_process_init
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from rest_framework import status
 
+from notificationsapp.async_delivery import run_delivery
+from notificationsapp.breaker import get_circuit_breaker
+from notificationsapp.idempotency import DeliveryGuard, DUPLICATE_RESULTS, \
+    get_delivery_ttl
+from notificationsapp.metrics import observe_delivery
+from notificationsapp.ratelimit import wait_for_slot, report_throttle
+from notificationsapp.revocation import is_mailout_cancelled
 from settings.celery import app
+from settings.commons import THROTTLE_CODES, CIRCUIT_OPEN_CODE
 
+CANCELLED_RESULT = {
+    "code": None,
+    "body": 'mailout cancelled'
+}
+CIRCUIT_OPEN_RESULT = {
+    "code": CIRCUIT_OPEN_CODE,
+    "body": 'provider circuit open'
+}
+_session = None
 
-@app.task
-def send_message(message_id, phone, text):
+
+def get_session():
+    global _session
+    if _session is None:
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=settings.SMS_API_POOL_SIZE,
+                              pool_block=True)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({
+            "accept": 'application/json',
+            "Authorization": f'Bearer {os.environ.get("API_TOKEN")}'
+        })
+        _session = session
+    return _session
+
+
+@worker_process_init.connect
+def reset_session(**kwargs):
+    # Never share the parent's sockets with forked pool processes.
+    global _session
+    _session = None
+
+
+def deliver_message(session, message_id, phone, text, guard=None):
     payload = json.dumps({
         "id": int(message_id),
         "phone": int(phone),
         "text": text
     })
-    headers = {
-        "accept": 'application/json',
-        "Authorization": f'Bearer {os.environ.get("API_TOKEN")}'
-    }
-    resp = requests.post(f'https://probe.fbrq.cloud/v1/send/{message_id}',
-                         data=payload, headers=headers)
+    breaker = get_circuit_breaker()
+    if not breaker.allow_request():
+        return dict(CIRCUIT_OPEN_RESULT)
+    wait_for_slot(phone)
+    claim = guard.claim(message_id, phone) if guard else None
+    if claim is not None:
+        # If this call had the half-open probe, someone else may use it.
+        breaker.release()
+        return dict(DUPLICATE_RESULTS[claim])
+    started = time.perf_counter()
+    try:
+        resp = session.post(f'{settings.SMS_API_URL}{message_id}',
+                            data=payload,
+                            timeout=(settings.SMS_API_CONNECT_TIMEOUT,
+                                     settings.SMS_API_READ_TIMEOUT))
+    except requests.RequestException as exc:
+        observe_delivery(phone, status.HTTP_503_SERVICE_UNAVAILABLE,
+                         time.perf_counter() - started)
+        breaker.record(status.HTTP_503_SERVICE_UNAVAILABLE)
+        if guard:
+            guard.release(message_id, phone)
+        return {
+            "code": status.HTTP_503_SERVICE_UNAVAILABLE,
+            "body": str(exc)
+        }
+    observe_delivery(phone, resp.status_code, time.perf_counter() - started)
+    breaker.record(resp.status_code)
+    if guard:
+        guard.settle(message_id, phone, resp.status_code)
+    if resp.status_code in THROTTLE_CODES:
+        report_throttle()
     return {
         "code": resp.status_code,
-        "body": resp.text
+        "body": resp.text[:settings.SMS_API_RESPONSE_LIMIT]
     }
+
+
+@app.task(ignore_result=settings.MAILOUT_DIRECT_STATUS,
+          store_errors_even_if_ignored=True)
+def send_message(message_id, phone, text, mailout_id=None):
+    if is_mailout_cancelled(mailout_id):
+        return CANCELLED_RESULT
+    guard = DeliveryGuard(mailout_id,
+                          get_delivery_ttl(send_message.request.expires))
+    return deliver_message(get_session(), message_id, phone, text, guard)
+
+
+@app.task(ignore_result=settings.MAILOUT_DIRECT_STATUS,
+          store_errors_even_if_ignored=True)
+def send_message_batch(messages, text, mailout_id=None):
+    if is_mailout_cancelled(mailout_id):
+        return [dict(CANCELLED_RESULT, id=int(message_id))
+                for message_id, _ in messages]
+    guard = DeliveryGuard(mailout_id,
+                          get_delivery_ttl(send_message_batch.request.expires))
+    if settings.SMS_API_ENGINE == 'asyncio':
+        return run_delivery([(message_id, phone, text)
+                             for message_id, phone in messages], guard=guard)
+    session = get_session()
+    results = []
+    for message_id, phone in messages:
+        result = deliver_message(session, message_id, phone, text, guard)
+        result['id'] = int(message_id)
+        results.append(result)
+    return results
+
+
+@app.task(ignore_result=True)
+def dispatch_due_messages():
+    from notificationsapp.fanout import dispatch_due_messages
+    return dispatch_due_messages()
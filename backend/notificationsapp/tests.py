@@ -1,3 +1,530 @@
-from django.test import TestCase
+import asyncio
+import tracemalloc
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, \
+    override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from prometheus_client import REGISTRY
+
+from notificationsapp.async_delivery import \
+    deliver_message as deliver_message_async
+from notificationsapp.breaker import RedisCircuitBreaker, \
+    LocalCircuitBreaker, HALF_OPEN_KEY, OPEN_KEY
+from notificationsapp.db_router import replica_reads
+from notificationsapp.fanout import fan_out_mailout, remove_messages, \
+    revoke_messages
+from notificationsapp.idempotency import DeliveryGuard, DELIVERED, SENDING
+from notificationsapp.metrics import observe_delivery
+from notificationsapp.middleware import PRIMARY_PIN_COOKIE, \
+    ReplicaReadMiddleware
+from notificationsapp.models import Mailout, MailoutMessage, \
+    MailoutRecipient, MailoutStats
+from notificationsapp.pagination import MailoutPagination, MessagePagination
+from notificationsapp.profiling import PROFILING_ENFORCE, set_profiling_mode
+from notificationsapp.ratelimit import LocalRateLimiter, RedisRateLimiter
+from notificationsapp.segments import get_segment, segment_key
+from notificationsapp.tasks import deliver_message
+from notificationsapp.views import MailoutListApiView
+from settings.commons import PHONE_PREFIX, SUCCESS_STATUS, FAILURE_STATUS, \
+    PENDING_STATUS, IN_PROGRESS_CODE
+
+
+@override_settings(MAILOUT_FANOUT_CHUNK_SIZE=100,
+                   MAILOUT_SEGMENT_CACHE_MAX_SIZE=10)
+class FanOutMemoryTestCase(TestCase):
+
+    def fan_out(self, prefix, size):
+        MailoutRecipient.objects.bulk_create([
+            MailoutRecipient(phone='7%s%07d' % (prefix, number),
+                             cell_provider_prefix=prefix)
+            for number in range(size)], batch_size=2000)
+        now = timezone.now()
+        # bulk_create skips post_save, so the fan-out is only run below.
+        Mailout.objects.bulk_create([Mailout(
+            datetime_start=now, datetime_finish=now + timedelta(days=1),
+            text='text', filter_field=PHONE_PREFIX, filter_value=prefix)])
+        mailout = Mailout.objects.latest('id')
+        # A plain function: a Mock would keep every call's arguments.
+        with mock.patch('notificationsapp.fanout.publish_tasks',
+                        lambda *args, **kwargs: None):
+            tracemalloc.start()
+            try:
+                fan_out_mailout(mailout)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        self.assertEqual(
+            MailoutMessage.objects.filter(mailout=mailout).count(), size)
+        return peak
+
+    def test_peak_memory_does_not_grow_with_audience(self):
+        small = self.fan_out('912', 500)
+        large = self.fan_out('916', 2000)
+        self.assertLess(large, small * 1.5)
+
+
+@mock.patch('notificationsapp.fanout.revoke_tasks')
+@mock.patch('notificationsapp.fanout.publish_tasks')
+class BatchRevocationTestCase(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        Mailout.objects.bulk_create([Mailout(
+            datetime_start=now, datetime_finish=now + timedelta(days=1),
+            text='text', filter_field=PHONE_PREFIX, filter_value='912')])
+        self.mailout = Mailout.objects.get()
+        # One batch task that delivered, failed and is still sending.
+        self.delivered, self.failed, self.pending = [
+            MailoutMessage.objects.create(
+                mailout=self.mailout, status=status, task_id='batch',
+                recipient=MailoutRecipient.objects.create(
+                    phone='7912000000%d' % number,
+                    cell_provider_prefix='912'))
+            for number, status in enumerate((
+                SUCCESS_STATUS, FAILURE_STATUS, PENDING_STATUS))]
+
+    def test_unfinished_siblings_are_redispatched(self, publish_tasks,
+                                                  revoke_tasks):
+        revoke_messages(self.mailout, ((self.delivered.id, 'batch'),))
+        revoke_tasks.assert_called_once_with({'batch'})
+        self.failed.refresh_from_db()
+        self.pending.refresh_from_db()
+        self.assertEqual((self.failed.status, self.failed.task_id),
+                         (FAILURE_STATUS, 'batch'))
+        self.assertNotEqual(self.pending.task_id, 'batch')
+        [(_, [batch], _), _] = publish_tasks.call_args
+        self.assertEqual([message.id for message in batch],
+                         [self.pending.id])
+
+    @override_settings(MAILOUT_FANOUT_CHUNK_SIZE=1)
+    def test_siblings_removed_later_are_not_redispatched(
+            self, publish_tasks, revoke_tasks):
+        remove_messages(self.mailout, MailoutMessage.objects.filter(
+            id__in=(self.delivered.id, self.pending.id)))
+        publish_tasks.assert_not_called()
+        self.assertEqual(list(MailoutMessage.objects.values_list(
+            'id', flat=True)), [self.failed.id])
+
+
+@override_settings(DATABASE_REPLICAS=['replica0'], DATABASE_REPLICA_LAG=5)
+class ReplicaReadTestCase(TestCase):
+    databases = {'default', 'replica0'}
+
+    def setUp(self):
+        cache.clear()
+
+    def get_mailouts(self):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica0']) as replica:
+            response = self.client.get('/api/mailout-list/',
+                                       HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return len(primary), len(replica)
+
+    def test_reads_go_to_replica(self):
+        primary, replica = self.get_mailouts()
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_writes_pin_client_to_primary(self):
+        # A write through the primary would lock the mirrored sqlite test
+        # database against the replica connection, so the write response
+        # comes from a stub view.
+        middleware = ReplicaReadMiddleware(
+            lambda request: HttpResponse(status=201))
+        response = middleware(RequestFactory().post('/api/recipient-create/'))
+        self.assertEqual(response.cookies[PRIMARY_PIN_COOKIE]['max-age'], 5)
+        self.client.cookies[PRIMARY_PIN_COOKIE] = \
+            response.cookies[PRIMARY_PIN_COOKIE].value
+        primary, replica = self.get_mailouts()
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_transactions_read_from_primary(self):
+        with replica_reads():
+            self.assertEqual(Mailout.objects.all().db, 'replica0')
+            with transaction.atomic():
+                self.assertEqual(Mailout.objects.all().db, 'default')
+
+    @override_settings(CACHE_SHARED=True)
+    def test_segments_read_from_replica_are_not_cached(self):
+        with replica_reads():
+            get_segment(PHONE_PREFIX, '912')
+        self.assertIsNone(cache.get(segment_key(PHONE_PREFIX, '912')))
+        get_segment(PHONE_PREFIX, '912')
+        self.assertIsNotNone(cache.get(segment_key(PHONE_PREFIX, '912')))
+
+
+@override_settings(SMS_API_BREAKER_THRESHOLD=2, SMS_API_READ_TIMEOUT=10.0)
+class RedisCircuitBreakerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        with mock.patch('redis.Redis.from_url', lambda url: client):
+            self.breaker = RedisCircuitBreaker('redis://breaker')
+
+    def trip(self):
+        self.breaker.record(500)
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record(503)
+        self.assertFalse(self.breaker.allow_request())
+        self.assertGreater(self.breaker.client.ttl(HALF_OPEN_KEY), 0)
+        # The reset period runs out.
+        self.breaker.client.delete(OPEN_KEY)
+
+    def test_trips_and_recovers(self):
+        self.trip()
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+        self.breaker.record(200)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_failed_probe_trips_again(self):
+        self.trip()
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record(502)
+        self.assertFalse(self.breaker.allow_request())
+
+
+class QueryBudgetTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        set_profiling_mode(PROFILING_ENFORCE)
+        self.addCleanup(set_profiling_mode, None)
+        self.client.force_login(get_user_model().objects.create_user('user'))
+        now = timezone.now()
+        Mailout.objects.bulk_create([Mailout(
+            datetime_start=now, datetime_finish=now + timedelta(days=1),
+            text='text', filter_field=PHONE_PREFIX, filter_value='912')])
+        mailout = Mailout.objects.get()
+        recipient = MailoutRecipient.objects.create(
+            phone='79120000001', cell_provider_prefix='912')
+        MailoutMessage.objects.bulk_create([MailoutMessage(
+            mailout=mailout, recipient=recipient) for _ in range(20)])
+        self.urls = ('/api/mailout-list/', '/api/mailout-info/%d' % mailout.id,
+                     '/api/mailout-info/%d/messages' % mailout.id)
+
+    def get(self, url, accept='application/json'):
+        with self.assertLogs('notificationsapp.sql') as logs:
+            response = self.client.get(url, HTTP_ACCEPT=accept)
+        return response, [record.levelname for record in logs.records]
+
+    def assertWithinBudget(self, url, accept='application/json'):
+        response, levels = self.get(url, accept)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(levels, ['INFO'])
+
+    def test_json(self):
+        for url in self.urls:
+            self.assertWithinBudget(url)
+
+    def test_page_number_fallback(self):
+        self.assertWithinBudget(self.urls[0] + '?page=1')
+        self.assertWithinBudget(self.urls[2] + '?page=1')
+
+    def test_browsable_api(self):
+        for url in self.urls:
+            self.assertWithinBudget(url, 'text/html')
+
+    def test_view_over_budget_is_stopped(self):
+        with mock.patch.object(MailoutListApiView, 'query_budget', 1):
+            response, levels = self.get(self.urls[0])
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()['detail'],
+                         'Query budget of 1 exceeded')
+        self.assertEqual(levels, ['WARNING'])
+
+
+@override_settings(SMS_API_BREAKER_THRESHOLD=1)
+class DuplicateProbeTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.breaker = LocalCircuitBreaker()
+        self.breaker.record(500)
+        # The reset period runs out: the next request is the probe.
+        self.breaker.open_until = 0
+        self.guard = DeliveryGuard(1, 60)
+        self.guard.claim(1, '79120000001')
+        for module in ('tasks', 'async_delivery'):
+            patcher = mock.patch(
+                'notificationsapp.%s.get_circuit_breaker' % module,
+                return_value=self.breaker)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_duplicate_gives_back_probe(self):
+        result = deliver_message(None, 2, '79120000001', 'text', self.guard)
+        self.assertEqual(result['code'], IN_PROGRESS_CODE)
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_async_duplicate_gives_back_probe(self):
+        async def deliver():
+            return await deliver_message_async(
+                None, asyncio.Semaphore(), 2, '79120000001', 'text',
+                self.guard)
+
+        result = asyncio.run(deliver())
+        self.assertEqual(result['code'], IN_PROGRESS_CODE)
+        self.assertTrue(self.breaker.allow_request())
+
+
+@override_settings(CACHE_SHARED=True)
+class ResponseCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        Mailout.objects.bulk_create([Mailout(
+            datetime_start=now, datetime_finish=now + timedelta(days=1),
+            text='text', filter_field=PHONE_PREFIX, filter_value='912')])
+        self.mailout = Mailout.objects.get()
+        MailoutStats.objects.create(mailout=self.mailout)
+
+    def get(self, url, etag=None):
+        headers = {'HTTP_ACCEPT': 'application/json'}
+        if etag is not None:
+            headers['HTTP_IF_NONE_MATCH'] = etag
+        return self.client.get(url, **headers)
+
+    def test_polls_are_not_modified_until_stats_change(self):
+        for url in ('/api/mailout-list/',
+                    '/api/mailout-info/%d' % self.mailout.id):
+            etag = self.get(url)['ETag']
+            self.assertEqual(self.get(url, etag).status_code, 304)
+            with self.captureOnCommitCallbacks(execute=True):
+                MailoutStats.adjust(self.mailout.id, {PENDING_STATUS: 1})
+            response = self.get(url, etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            self.assertEqual(response.json(), self.get(url).json())
+
+    @override_settings(CACHE_SHARED=False)
+    def test_no_validators_without_shared_cache(self):
+        response = self.get('/api/mailout-list/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+
+class SegmentCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_segments_are_not_cached_without_shared_cache(self):
+        get_segment(PHONE_PREFIX, '912')
+        self.assertIsNone(cache.get(segment_key(PHONE_PREFIX, '912')))
+
+    @override_settings(CACHE_SHARED=True)
+    def test_segments_are_cached_until_invalidated(self):
+        MailoutRecipient.objects.create(phone='79120000001',
+                                        cell_provider_prefix='912')
+        self.assertEqual(get_segment(PHONE_PREFIX, '912')['size'], 1)
+        MailoutRecipient.objects.create(phone='79120000002',
+                                        cell_provider_prefix='912')
+        self.assertEqual(get_segment(PHONE_PREFIX, '912')['size'], 2)
+
+
+@override_settings(MAILOUT_IMPORT_BATCH_SIZE=1)
+class RecipientImportTestCase(TestCase):
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_user('user'))
+
+    def post(self, content):
+        return self.client.post('/api/recipient-import/', {
+            'file': SimpleUploadedFile('recipients.csv', content.encode())},
+            HTTP_ACCEPT='application/json')
+
+    def test_oversized_field_fails_its_row(self):
+        response = self.post(
+            'phone,cell_provider_prefix,tags\n'
+            '79120000001,912,a\n'
+            '79120000002,912,%s\n'
+            '79120000003,912,a\n' % ('a' * 200000))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual(response.json()['errors'][0]['row'], 2)
+        self.assertEqual(MailoutRecipient.objects.count(), 2)
+
+    def test_broken_header_fails_the_file(self):
+        response = self.post('%s\n79120000001,912,a\n' % ('a' * 200000))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 0)
+        self.assertEqual(response.json()['failed'], 1)
+
+
+class KeysetPaginationTestCase(TestCase):
+
+    def setUp(self):
+        self.finish = timezone.now() + timedelta(days=1)
+        Mailout.objects.bulk_create([Mailout(
+            datetime_start=timezone.now(), datetime_finish=finish,
+            text='text', filter_field=PHONE_PREFIX, filter_value='912')
+            for finish in [self.finish] * 5 + [
+                self.finish + timedelta(microseconds=1),
+                self.finish - timedelta(hours=1)]])
+        self.mailout = Mailout.objects.earliest('id')
+        recipient = MailoutRecipient.objects.create(
+            phone='79120000001', cell_provider_prefix='912')
+        MailoutMessage.objects.bulk_create([MailoutMessage(
+            mailout=self.mailout, recipient=recipient, sent_at=sent_at)
+            for sent_at in [None] * 3 + [self.finish] * 3 + [
+                self.finish - timedelta(hours=1)]])
+
+    def walk(self, url):
+        ids = []
+        while url is not None:
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 200)
+            ids.extend(row['id'] for row in response.json()['results'])
+            url = response.json()['next']
+        return ids
+
+    @mock.patch.object(MailoutPagination, 'page_size', 2)
+    def test_mailouts_across_equal_finish_times(self):
+        expected = list(Mailout.objects.order_by(
+            '-datetime_finish', 'id').values_list('id', flat=True))
+        self.assertEqual(self.walk('/api/mailout-list/'), expected)
+
+    @mock.patch.object(MessagePagination, 'page_size', 2)
+    def test_messages_across_equal_and_missing_send_times(self):
+        messages = MailoutMessage.objects.order_by('id')
+        expected = [message.id for message in messages.filter(
+            sent_at__isnull=True)] + [message.id for message in messages.filter(
+                sent_at__isnull=False).order_by('-sent_at', 'id')]
+        self.assertEqual(self.walk(
+            '/api/mailout-info/%d/messages' % self.mailout.id), expected)
+
+
+@override_settings(SMS_API_RATE_LIMIT=2, SMS_API_PREFIX_RATE_LIMIT=1,
+                   SMS_API_THROTTLE_COOLDOWN=60)
+class LocalRateLimiterTestCase(SimpleTestCase):
+
+    def get_limiter(self):
+        return LocalRateLimiter()
+
+    def setUp(self):
+        self.limiter = self.get_limiter()
+
+    def test_buckets(self):
+        self.assertEqual(self.limiter.acquire('79120000001'), 0)
+        # The prefix bucket holds a single token.
+        self.assertAlmostEqual(self.limiter.acquire('79120000002'), 1, 1)
+        # The global bucket's two tokens are gone as well.
+        self.assertAlmostEqual(self.limiter.acquire('79160000001'), 0.5, 1)
+
+    def test_throttle_halves_rates(self):
+        self.assertEqual(self.limiter.throttle(), 0.5)
+        self.assertEqual(self.limiter.acquire('79120000001'), 0)
+        self.assertAlmostEqual(self.limiter.acquire('79120000002'), 2, 1)
+
+
+class RedisRateLimiterTestCase(LocalRateLimiterTestCase):
+
+    def get_limiter(self):
+        client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        with mock.patch('redis.Redis.from_url', lambda url: client):
+            return RedisRateLimiter('redis://ratelimit')
+
+
+@override_settings(SMS_API_BREAKER_THRESHOLD=2, SMS_API_BREAKER_WINDOW=60,
+                   SMS_API_BREAKER_RESET=30)
+class LocalCircuitBreakerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.breaker = LocalCircuitBreaker()
+
+    def trip(self):
+        self.breaker.record(500)
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record(503)
+        self.assertFalse(self.breaker.allow_request())
+        # The reset period runs out.
+        self.breaker.open_until = 0
+
+    def test_trips_and_recovers(self):
+        self.trip()
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+        self.breaker.record(200)
+        self.assertTrue(self.breaker.allow_request())
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_failed_probe_trips_again(self):
+        self.trip()
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record(502)
+        self.assertFalse(self.breaker.allow_request())
+
+    def test_client_errors_do_not_count(self):
+        self.breaker.record(500)
+        self.breaker.record(400)
+        self.breaker.record(500)
+        self.assertTrue(self.breaker.allow_request())
+
+
+class DeliveryGuardTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.guard = DeliveryGuard(1, 60)
+
+    def test_one_claim_at_a_time(self):
+        self.assertIsNone(self.guard.claim(1, '79120000001'))
+        self.assertEqual(self.guard.claim(1, '79120000001'), SENDING)
+        # The same phone within the mailout, as another message.
+        self.assertEqual(self.guard.claim(2, '79120000001'), SENDING)
+        self.assertIsNone(DeliveryGuard(2, 60).claim(3, '79120000001'))
+
+    def test_failed_delivery_can_be_claimed_again(self):
+        self.guard.claim(1, '79120000001')
+        self.guard.settle(1, '79120000001', 500)
+        self.assertIsNone(self.guard.claim(1, '79120000001'))
+
+    def test_delivered_message_is_not_claimed_again(self):
+        self.guard.claim(1, '79120000001')
+        self.guard.settle(1, '79120000001', 200)
+        self.assertEqual(self.guard.claim(1, '79120000001'), DELIVERED)
+        self.assertEqual(self.guard.claim(2, '79120000001'), DELIVERED)
+
+
+class MetricsTestCase(TestCase):
+
+    def get_sample(self, name, labels=None):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_delivery_is_counted_by_code_and_prefix(self):
+        labels = {'code': '200', 'prefix': '912'}
+        sent = self.get_sample('notifications_sent_messages_total', labels)
+        requests = self.get_sample(
+            'notifications_provider_request_seconds_count', {'code': '200'})
+        observe_delivery('79120000001', 200, 0.2)
+        self.assertEqual(self.get_sample(
+            'notifications_sent_messages_total', labels), sent + 1)
+        self.assertEqual(self.get_sample(
+            'notifications_provider_request_seconds_count', {'code': '200'}),
+            requests + 1)
+
+    def test_backlog_of_mailouts_not_started(self):
+        now = timezone.now()
+        Mailout.objects.bulk_create([Mailout(
+            datetime_start=start, datetime_finish=now + timedelta(days=2),
+            text='text', filter_field=PHONE_PREFIX, filter_value='912')
+            for start in (now - timedelta(hours=1), now + timedelta(days=1))])
+        started, waiting = Mailout.objects.order_by('datetime_start')
+        MailoutStats.objects.create(mailout=started, pending=3)
+        MailoutStats.objects.create(mailout=waiting, pending=5)
+        response = self.client.get('/metrics')
+        self.assertIn(b'notifications_eta_backlog 5.0', response.content)
@@ -1,10 +1,21 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework import routers
 
 from notificationsapp.views import RecipientPostApiView, RecipientPutApiView, \
     RecipientDeleteApiView, MailoutCreateApiView, MailoutListApiView, \
     MailoutDeleteApiView, MailoutPatchApiView, MailoutDetailApiView, \
-    MailoutManageViewSet, MailoutMessageDetailApiView
+    MailoutManageViewSet, MailoutMessageDetailApiView, AudiencePreviewApiView, \
+    RecipientImportApiView, MailoutCohortsApiView, MailoutMessagesApiView, \
+    MailoutReportApiView
+
+if settings.ASYNC_READ_VIEWS:
+    from notificationsapp.async_views import mailout_list, mailout_detail, \
+        mailout_messages
+else:
+    mailout_list = MailoutListApiView.as_view()
+    mailout_detail = MailoutDetailApiView.as_view()
+    mailout_messages = MailoutMessagesApiView.as_view()
 
 router = routers.DefaultRouter()
 router.register('mailouts', MailoutManageViewSet, 'mailout')
@@ -12,12 +23,24 @@ router.register('messages', MailoutMessageDetailApiView, 'message')
 
 urlpatterns = [
     path('recipient-create/', RecipientPostApiView.as_view()),
+    path('recipient-import/', RecipientImportApiView.as_view()),
     path('recipient-update/<int:pk>', RecipientPutApiView.as_view()),
     path('recipient-delete/<int:pk>', RecipientDeleteApiView.as_view()),
+    path('audience-preview/', AudiencePreviewApiView.as_view()),
     path('mailout-create/', MailoutCreateApiView.as_view()),
-    path('mailout-list/', MailoutListApiView.as_view()),
+    path('mailout-list/', mailout_list),
     path('mailout-update/<int:pk>', MailoutPatchApiView.as_view()),
     path('mailout-delete/<int:pk>', MailoutDeleteApiView.as_view()),
-    path('mailout-info/<int:pk>', MailoutDetailApiView.as_view()),
+    path('mailout-info/<int:pk>', mailout_detail),
+    path('mailout-info/<int:pk>/messages', mailout_messages,
+         name='mailout-messages'),
+    path('mailout-cohorts/<int:pk>', MailoutCohortsApiView.as_view()),
     path('manage/', include(router.urls)),
 ]
+
+# Under ASGI Django 4.0 iterates streamed bodies on the event loop, where
+# the report can't query the database; the ASGI service leaves reports to
+# the WSGI one.
+if not settings.ASYNC_READ_VIEWS:
+    urlpatterns.append(path('mailout-report/<int:pk>',
+                            MailoutReportApiView.as_view()))
@@ -0,0 +1,30 @@
+from itertools import islice
+
+from django.db import connections
+
+
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_queryset_chunks(queryset, fields, chunk_size):
+    # Yields lists of at most chunk_size value tuples, the first field of
+    # which must be 'id'. PostgreSQL streams them through a server-side
+    # cursor; other backends (or pgbouncer setups with server-side cursors
+    # disabled) page by primary key, so nothing is buffered past one chunk.
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not connection.settings_dict.get(
+            'DISABLE_SERVER_SIDE_CURSORS'):
+        rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+        yield from iter_chunks(rows, chunk_size)
+        return
+    queryset = queryset.order_by('id').values_list(*fields)
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield chunk
+        chunk = list(queryset.filter(id__gt=chunk[-1][0])[:chunk_size])
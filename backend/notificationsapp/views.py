@@ -1,19 +1,40 @@
+import codecs
+
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema, no_body
 from rest_framework import status
 from rest_framework.generics import CreateAPIView, GenericAPIView, \
-    DestroyAPIView, ListAPIView, RetrieveAPIView
+    DestroyAPIView, ListAPIView, RetrieveAPIView, get_object_or_404
 from rest_framework.mixins import UpdateModelMixin, RetrieveModelMixin, \
     DestroyModelMixin, ListModelMixin
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
-from notificationsapp.models import MailoutRecipient, Mailout, MailoutMessage
+from notificationsapp.caching import CachedResponseMixin, \
+    ActiveCachedResponseMixin
+from notificationsapp.cohorts import get_cohort_plan
+from notificationsapp.exporters import export_report, get_report_filename, \
+    CONTENT_TYPES
+from notificationsapp.fanout import revoke_messages
+from notificationsapp.importers import import_recipients, read_rows, \
+    guess_format, DECODE_ERRORS
+from notificationsapp.models import MailoutRecipient, Mailout, MailoutMessage, \
+    MailoutStats
+from notificationsapp.pagination import MailoutPagination, MessagePagination
 from notificationsapp.serializers import RecipientSerializer, \
     RecipientPatchSerializer, RecipientDeleteSerializer, MailoutSerializer, \
     MailoutListSerializer, MailoutDeleteSerializer, MailoutDetailSerializer, \
     MailoutMessageSerializer, MailoutMessagePostSerializer, \
-    MailoutManageSerializer, MailoutPatchSerializer
+    MailoutManageSerializer, MailoutPatchSerializer, AudiencePreviewSerializer, \
+    RecipientImportSerializer, CohortSerializer, MailoutMessageListSerializer, \
+    ReportExportSerializer
+from notificationsapp.revocation import cancel_mailout
+from notificationsapp.segments import get_segment
 
 
 class RecipientPostApiView(CreateAPIView):
@@ -34,6 +55,44 @@ class RecipientPostApiView(CreateAPIView):
         return super().post(request, *args, **kwargs)
 
 
+class RecipientImportApiView(GenericAPIView):
+    serializer_class = RecipientImportSerializer
+    parser_classes = (MultiPartParser,)
+
+    @swagger_auto_schema(
+        operation_id='recipient_import',
+        operation_description='Bulk import of recipients from a CSV (with a header row) or NDJSON file '
+                              'with phone, cell_provider_prefix, tags (comma-separated) and timezone columns',
+        responses={
+            status.HTTP_200_OK: openapi.Response(
+                description='Import report',
+                examples={
+                    "application/json": {
+                        "created": 2,
+                        "failed": 1,
+                        "errors": [
+                            {
+                                "row": 2,
+                                "errors": [
+                                    "Incorrect phone number provided!"
+                                ]
+                            }
+                        ]
+                    }
+                }
+            )
+        }
+    )
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.validated_data['file']
+        file_format = serializer.validated_data.get(
+            'format') or guess_format(upload.name)
+        lines = codecs.iterdecode(upload, 'utf-8-sig', DECODE_ERRORS)
+        return Response(import_recipients(read_rows(lines, file_format)))
+
+
 class RecipientPutApiView(GenericAPIView, UpdateModelMixin):
     serializer_class = RecipientPatchSerializer
     queryset = MailoutRecipient.objects.all()
@@ -80,6 +139,34 @@ class RecipientDeleteApiView(DestroyAPIView):
         return super().delete(request, *args, **kwargs)
 
 
+class AudiencePreviewApiView(GenericAPIView):
+    serializer_class = AudiencePreviewSerializer
+
+    @swagger_auto_schema(
+        operation_id='audience_preview',
+        query_serializer=AudiencePreviewSerializer,
+        operation_description='Number of recipients a mailout with the given filter would be sent to',
+        responses={
+            status.HTTP_200_OK: openapi.Response(
+                description='Audience size',
+                examples={
+                    "application/json": {
+                        "filter_field": "tag",
+                        "filter_value": "clients",
+                        "recipients": 1500
+                    }
+                }
+            )
+        }
+    )
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        segment = get_segment(**serializer.validated_data)
+        return Response({**serializer.validated_data,
+                         'recipients': segment['size']})
+
+
 class MailoutCreateApiView(CreateAPIView):
     serializer_class = MailoutSerializer
     queryset = Mailout.objects.all()
@@ -98,9 +185,13 @@ class MailoutCreateApiView(CreateAPIView):
         return super().post(request, *args, **kwargs)
 
 
-class MailoutListApiView(ListAPIView):
+class MailoutListApiView(CachedResponseMixin, ListAPIView):
     serializer_class = MailoutListSerializer
-    queryset = Mailout.objects.all()
+    queryset = Mailout.objects.select_related('stats')
+    pagination_class = MailoutPagination
+    # The view's own queries, the session and user lookups, the page-number
+    # fallback's count and one to spare.
+    query_budget = 5
 
     @swagger_auto_schema(
         operation_id='mailout_list',
@@ -115,6 +206,10 @@ class MailoutDeleteApiView(DestroyAPIView):
     serializer_class = MailoutDeleteSerializer
     queryset = Mailout.objects.all()
 
+    def perform_destroy(self, instance):
+        cancel_mailout(instance)
+        super().perform_destroy(instance)
+
     @swagger_auto_schema(
         operation_id='mailout_delete',
         request_body=no_body,
@@ -157,12 +252,13 @@ class MailoutPatchApiView(GenericAPIView, UpdateModelMixin):
         return self.partial_update(request, *args, **kwargs)
 
 
-class MailoutDetailApiView(RetrieveAPIView):
+class MailoutDetailApiView(CachedResponseMixin, RetrieveAPIView):
     serializer_class = MailoutDetailSerializer
+    query_budget = 4
 
     def get_queryset(self):
         pk = self.kwargs.get('pk')
-        return Mailout.objects.filter(pk=pk)
+        return Mailout.objects.filter(pk=pk).select_related('stats')
 
     @swagger_auto_schema(
         operation_id='mailout_read',
@@ -185,14 +281,103 @@ class MailoutDetailApiView(RetrieveAPIView):
         return super().get(request, *args, **kwargs)
 
 
-class MailoutManageViewSet(GenericViewSet,
+class MailoutMessagesApiView(ListAPIView):
+    serializer_class = MailoutMessageListSerializer
+    pagination_class = MessagePagination
+    query_budget = 6
+    filterset_fields = {
+        'status': ('exact', 'in',),
+        'sent_at': ('gte', 'lte', 'isnull',),
+        'recipient__phone': ('exact',),
+    }
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return MailoutMessage.objects.none()
+        mailout = get_object_or_404(Mailout.objects.only('id'),
+                                    pk=self.kwargs.get('pk'))
+        return MailoutMessage.objects.filter(mailout=mailout).select_related(
+            'recipient').only('id', 'sent_at', 'status', 'attempts',
+                              'recipient_id', 'recipient__phone')
+
+    @swagger_auto_schema(
+        operation_id='mailout_messages',
+        request_body=no_body,
+        operation_description='Paginated list of the messages of a single Mailout, filterable by status, sending time and phone'
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class MailoutReportApiView(GenericAPIView):
+    serializer_class = ReportExportSerializer
+    queryset = Mailout.objects.all()
+
+    @swagger_auto_schema(
+        operation_id='mailout_report',
+        query_serializer=ReportExportSerializer,
+        operation_description='Streamed per-message delivery report of a Mailout (id, phone, status, sent_at, attempts) as CSV or NDJSON',
+        responses={
+            status.HTTP_200_OK: openapi.Response(
+                description='Report file'
+            )
+        }
+    )
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        file_format = serializer.validated_data['file_format']
+        mailout = self.get_object()
+        response = StreamingHttpResponse(export_report(mailout, file_format),
+                                         content_type=CONTENT_TYPES[file_format])
+        response['Content-Disposition'] = 'attachment; filename="%s"' % (
+            get_report_filename(mailout, file_format))
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class MailoutCohortsApiView(GenericAPIView):
+    serializer_class = CohortSerializer
+    queryset = Mailout.objects.all()
+
+    @swagger_auto_schema(
+        operation_id='mailout_cohorts',
+        request_body=no_body,
+        operation_description='Delivery plan of a Mailout: recipients grouped into cohorts by UTC offset, each with its own sending window',
+        responses={
+            status.HTTP_200_OK: CohortSerializer(many=True),
+            status.HTTP_404_NOT_FOUND: openapi.Response(
+                description='Bad request',
+                examples={
+                    "application/json": {
+                        "detail": [
+                            "Not found."
+                        ]
+                    }
+                }
+            )
+        }
+    )
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(
+            get_cohort_plan(self.get_object()), many=True)
+        return Response(serializer.data)
+
+
+class MailoutManageViewSet(ActiveCachedResponseMixin,
+                           GenericViewSet,
                            RetrieveModelMixin,
                            UpdateModelMixin,
                            DestroyModelMixin,
                            ListModelMixin):
+    pagination_class = MailoutPagination
 
     def get_queryset(self):
-        return Mailout.objects.filter(datetime_finish__gte=timezone.now())
+        return Mailout.objects.filter(
+            datetime_finish__gte=timezone.now()).select_related(
+            'stats').prefetch_related(Prefetch(
+                'mailout_message',
+                queryset=MailoutMessage.objects.only('id', 'mailout_id')))
 
     def get_serializer_class(self):
         if self.request.method == 'PATCH':
@@ -200,6 +385,10 @@ class MailoutManageViewSet(GenericViewSet,
         else:
             return MailoutManageSerializer
 
+    def perform_destroy(self, instance):
+        cancel_mailout(instance)
+        super().perform_destroy(instance)
+
     @swagger_auto_schema(
         operation_id='manage_mailout_list',
         request_body=no_body,
@@ -290,17 +479,25 @@ class MailoutMessageDetailApiView(GenericViewSet,
                                   UpdateModelMixin,
                                   DestroyModelMixin,
                                   ListModelMixin):
+    pagination_class = MessagePagination
 
     def get_queryset(self):
-        pk = self.kwargs.get('pk')
-        return MailoutMessage.objects.filter(pk=pk).filter(
-            mailout__datetime_finish__gte=timezone.now())
+        return MailoutMessage.objects.filter(
+            mailout__datetime_finish__gte=timezone.now()).select_related(
+            'recipient').prefetch_related('recipient__tags')
 
     def get_serializer_class(self):
         if self.request.method in ['GET', 'DELETE']:
             return MailoutMessageSerializer
         return MailoutMessagePostSerializer
 
+    def perform_destroy(self, instance):
+        revoke_messages(instance.mailout, ((instance.id, instance.task_id),))
+        # The response versions are bumped once the delete has committed.
+        with transaction.atomic():
+            MailoutStats.adjust(instance.mailout_id, {instance.status: -1})
+            super().perform_destroy(instance)
+
     @swagger_auto_schema(
         operation_id='manage_message_list',
         request_body=no_body,
@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 import pytz
 
 SUCCESS_STATUS = 'SUCCESS'
@@ -5,10 +7,34 @@ PENDING_STATUS = 'PENDING'
 FAILURE_STATUS = 'FAILURE'
 RETRY_STATUS = 'RETRY'
 REVOKE_STATUS = 'REVOKED'
+SCHEDULED_STATUS = 'SCHEDULED'
+FINAL_STATUSES = (SUCCESS_STATUS, FAILURE_STATUS,)
+STATUS_COUNTERS = {
+    SUCCESS_STATUS: 'success',
+    FAILURE_STATUS: 'failure',
+    PENDING_STATUS: 'pending',
+    SCHEDULED_STATUS: 'pending',
+    RETRY_STATUS: 'retry',
+    REVOKE_STATUS: 'revoked',
+}
 TIMEZONES = tuple(zip(pytz.all_timezones, pytz.all_timezones))
+# Local time windows span from UTC-12 to UTC+14.
+LOCAL_TIME_SPREAD = timedelta(hours=26)
 TAG = 'tag'
 PHONE_PREFIX = 'cell_provider_prefix'
+TAG_SEPARATOR = ','
 FILTER_TYPE = [
     (TAG, 'user tag'),
     (PHONE_PREFIX, 'phone prefix'),
 ]
+RETRY_CODES = (400, 429, 503,)
+THROTTLE_CODES = (429,)
+CIRCUIT_OPEN_CODE = 'CIRCUIT_OPEN'
+IN_PROGRESS_CODE = 'IN_PROGRESS'
+PARKED_CODES = (CIRCUIT_OPEN_CODE, IN_PROGRESS_CODE,)
+CSV_FORMAT = 'csv'
+NDJSON_FORMAT = 'ndjson'
+IMPORT_FORMATS = [
+    (CSV_FORMAT, 'CSV with a header row'),
+    (NDJSON_FORMAT, 'newline-delimited JSON'),
+]
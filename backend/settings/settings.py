@@ -32,6 +32,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'notificationsapp.middleware.ReplicaReadMiddleware',
+    'notificationsapp.middleware.QueryProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -68,6 +70,30 @@ DATABASES = {
     }
 }
 
+DATABASE_REPLICAS = []
+for number, replica in enumerate(filter(None, os.environ.get(
+        'DB_REPLICA_HOSTS', '').split(','))):
+    host, _, port = replica.strip().partition(':')
+    DATABASE_REPLICAS.append('replica%d' % number)
+    DATABASES[DATABASE_REPLICAS[-1]] = dict(
+        DATABASES['default'], HOST=host,
+        PORT=port or DATABASES['default']['PORT'], TEST={'MIRROR': 'default'})
+DATABASE_ROUTERS = ['notificationsapp.db_router.ReplicaRouter']
+DATABASE_REPLICA_LAG = float(os.environ.get('DB_REPLICA_LAG', 5))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['CACHE_URL'],
+    } if os.environ.get('CACHE_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+# The local-memory stand-in isn't seen by other processes, so what has to
+# be invalidated across them (segments, response versions) isn't cached
+# there.
+CACHE_SHARED = bool(os.environ.get('CACHE_URL'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -114,8 +140,97 @@ REST_FRAMEWORK = {
     ]
 }
 
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'notificationsapp.sql': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER', 'redis://localhost:6379')
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_RESULT_BACKEND = 'django-db'
 CELERY_CACHE_BACKEND = 'django-cache'
 CELERY_TASK_SERIALIZER = 'json'
+
+MAILOUT_FANOUT_CHUNK_SIZE = int(
+    os.environ.get('MAILOUT_FANOUT_CHUNK_SIZE', 1000))
+MAILOUT_SEGMENT_CACHE_MAX_SIZE = int(
+    os.environ.get('MAILOUT_SEGMENT_CACHE_MAX_SIZE', 100000))
+MAILOUT_SEGMENT_CACHE_TIMEOUT = int(
+    os.environ.get('MAILOUT_SEGMENT_CACHE_TIMEOUT', 3600))
+MAILOUT_IMPORT_BATCH_SIZE = int(
+    os.environ.get('MAILOUT_IMPORT_BATCH_SIZE', 5000))
+MAILOUT_EXPORT_CHUNK_SIZE = int(
+    os.environ.get('MAILOUT_EXPORT_CHUNK_SIZE', 5000))
+MAILOUT_IMPORT_MAX_ERRORS = int(
+    os.environ.get('MAILOUT_IMPORT_MAX_ERRORS', 1000))
+MAILOUT_STATUS_FLUSH_SIZE = int(
+    os.environ.get('MAILOUT_STATUS_FLUSH_SIZE', 1))
+MAILOUT_STATUS_FLUSH_INTERVAL = float(
+    os.environ.get('MAILOUT_STATUS_FLUSH_INTERVAL', 1))
+MAILOUT_DIRECT_STATUS = os.environ.get(
+    'MAILOUT_DIRECT_STATUS', 'False').lower() in ('true', '1', 'yes')
+MAILOUT_REVOKE_BATCH_SIZE = int(
+    os.environ.get('MAILOUT_REVOKE_BATCH_SIZE', 1000))
+MAILOUT_SEND_BATCH_SIZE = int(os.environ.get('MAILOUT_SEND_BATCH_SIZE', 1))
+MAILOUT_RETRY_BASE_DELAY = int(
+    os.environ.get('MAILOUT_RETRY_BASE_DELAY', 60))
+MAILOUT_RETRY_MAX_DELAY = int(os.environ.get('MAILOUT_RETRY_MAX_DELAY', 3600))
+MAILOUT_RETRY_MAX_ATTEMPTS = int(
+    os.environ.get('MAILOUT_RETRY_MAX_ATTEMPTS', 5))
+MAILOUT_IDEMPOTENCY_TTL = int(
+    os.environ.get('MAILOUT_IDEMPOTENCY_TTL', 86400))
+MAILOUT_RESPONSE_CACHE_TIMEOUT = int(
+    os.environ.get('MAILOUT_RESPONSE_CACHE_TIMEOUT', 300))
+SQL_PROFILING = os.environ.get('SQL_PROFILING', 'off').lower()
+SQL_PROFILING_REFRESH = float(os.environ.get('SQL_PROFILING_REFRESH', 5))
+SQL_QUERY_BUDGET = int(os.environ.get('SQL_QUERY_BUDGET', 0))
+METRICS_WORKER_PORT = int(os.environ.get('METRICS_WORKER_PORT', 0))
+ASYNC_READ_VIEWS = os.environ.get(
+    'ASYNC_READ_VIEWS', 'False').lower() in ('true', '1', 'yes')
+MAILOUT_DUE_DISPATCHER = os.environ.get(
+    'MAILOUT_DUE_DISPATCHER', 'False').lower() in ('true', '1', 'yes')
+MAILOUT_DISPATCH_INTERVAL = float(
+    os.environ.get('MAILOUT_DISPATCH_INTERVAL', 10))
+MAILOUT_DISPATCH_BATCH_SIZE = int(
+    os.environ.get('MAILOUT_DISPATCH_BATCH_SIZE', 5000))
+
+CELERY_BEAT_SCHEDULE = {
+    'dispatch-due-messages': {
+        'task': 'notificationsapp.tasks.dispatch_due_messages',
+        'schedule': MAILOUT_DISPATCH_INTERVAL,
+        'options': {'expires': MAILOUT_DISPATCH_INTERVAL},
+    },
+} if MAILOUT_DUE_DISPATCHER else {}
+
+SMS_API_URL = os.environ.get('SMS_API_URL', 'https://probe.fbrq.cloud/v1/send/')
+SMS_API_POOL_SIZE = int(os.environ.get('SMS_API_POOL_SIZE', 10))
+SMS_API_CONNECT_TIMEOUT = float(os.environ.get('SMS_API_CONNECT_TIMEOUT', 3.05))
+SMS_API_READ_TIMEOUT = float(os.environ.get('SMS_API_READ_TIMEOUT', 10))
+SMS_API_RESPONSE_LIMIT = int(os.environ.get('SMS_API_RESPONSE_LIMIT', 500))
+# Only batch tasks (MAILOUT_SEND_BATCH_SIZE > 1) go through the asyncio engine.
+SMS_API_ENGINE = os.environ.get('SMS_API_ENGINE', 'requests')
+SMS_API_ASYNC_CONCURRENCY = int(
+    os.environ.get('SMS_API_ASYNC_CONCURRENCY', 200))
+SMS_API_RATE_LIMIT = float(os.environ.get('SMS_API_RATE_LIMIT', 0))
+SMS_API_PREFIX_RATE_LIMIT = float(
+    os.environ.get('SMS_API_PREFIX_RATE_LIMIT', 0))
+SMS_API_RATE_LIMIT_URL = os.environ.get('SMS_API_RATE_LIMIT_URL',
+                                        os.environ.get('CACHE_URL'))
+SMS_API_THROTTLE_COOLDOWN = int(
+    os.environ.get('SMS_API_THROTTLE_COOLDOWN', 60))
+SMS_API_BREAKER_THRESHOLD = int(
+    os.environ.get('SMS_API_BREAKER_THRESHOLD', 20))
+SMS_API_BREAKER_WINDOW = int(os.environ.get('SMS_API_BREAKER_WINDOW', 30))
+SMS_API_BREAKER_RESET = int(os.environ.get('SMS_API_BREAKER_RESET', 60))
@@ -0,0 +1,6 @@
+from settings.settings import *
+
+if 'replica0' not in DATABASES:
+    # Replica routing is tested against a mirror of the test database.
+    DATABASES['replica0'] = dict(DATABASES['default'],
+                                 TEST={'MIRROR': 'default'})
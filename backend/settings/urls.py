@@ -4,6 +4,8 @@ from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 
+from notificationsapp.metrics import metrics_view
+
 API_TITLE = 'Notifications API'
 API_DESCRIPTION = 'HTTP API for creating and managing mail-outs.'
 schema_view = get_schema_view(
@@ -31,4 +33,5 @@ urlpatterns = [
     path('api-auth/', include('rest_framework.urls')),
     path('api/', include('notificationsapp.urls')),
     path('docs/', schema_view.with_ui('swagger', cache_timeout=0)),
+    path('metrics', metrics_view),
 ]